@@ -0,0 +1,82 @@
+"""Compares formatting deadline dates with strftime under a switched locale and with the lookup tables of dateformat.
+
+Run the benchmark:  python benchmarks/dateformat_benchmark.py [--dates N] [--threads N] [--locale NAME]
+
+Without the Russian locale installed strftime runs under the C locale, which only makes it look faster than it is.
+"""
+import argparse
+import locale
+import pathlib
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import dateformat
+import utils
+
+LOCALE_LOCK = threading.Lock()
+
+@contextmanager
+def time_locale(name: str):
+    # The helper the bot used before, switching the process-wide locale under a lock
+    with LOCALE_LOCK:
+        saved = locale.setlocale(locale.LC_TIME)
+        try:
+            yield locale.setlocale(locale.LC_TIME, name)
+        finally:
+            locale.setlocale(locale.LC_TIME, saved)
+
+def with_locale(name: str, dates: list[datetime]):
+    for d in dates:
+        with time_locale(name):
+            d.strftime("%d %b %Y")
+            d.strftime("%a, %d %b")
+
+def with_tables(dates: list[datetime]):
+    for d in dates:
+        dateformat.day_month_year(d)
+        dateformat.weekday_day_month(d)
+
+def measure(name: str, run, dates: list[datetime], threads: int):
+    chunks = [dates[i::threads] for i in range(threads)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(run, chunks))
+    elapsed = time.perf_counter() - started
+    print(f"{name:<10} {threads} threads: {elapsed / len(dates) * 1e6:.2f} us per date")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dates', type=int, default=200000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--locale', default='ru_RU.UTF-8')
+    args = parser.parse_args()
+
+    name = args.locale
+    try:
+        with time_locale(name):
+            pass
+    except locale.Error:
+        print(f"Locale {name} is not installed, strftime runs under the C locale")
+        name = 'C'
+
+    start = utils.tz_now()
+    dates = [start + timedelta(hours=i) for i in range(args.dates)]
+
+    if name != 'C':
+        with time_locale(name):
+            mismatches = sum(d.strftime("%d %b %Y") != dateformat.day_month_year(d) or
+                             d.strftime("%a, %d %b") != dateformat.weekday_day_month(d) for d in dates[:24 * 366:24])
+        print(f"Mismatches with strftime over a year: {mismatches}")
+
+    for threads in sorted({1, args.threads}):
+        measure('setlocale', lambda chunk: with_locale(name, chunk), dates, threads)
+        measure('tables', with_tables, dates, threads)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Measures per-user note queries on a large notes database, before and after the index migration.
+
+Run the benchmark:  python benchmarks/notes_benchmark.py [--notes N] [--users N] [--queries N]
+"""
+import argparse
+import pathlib
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import constants
+import database
+
+def populate(path: pathlib.Path, notes: int, users: int):
+    db = database.sqlite3.connect(path)
+    database.migrate(db, "benchmark", database.NotesDatabase.MIGRATIONS[:1])
+
+    now = int(time.time())
+    rows = ((random.randrange(users), None, "note", now + random.randrange(-30, 60) * 86400, 0, random.random() < 0.7)
+            for _ in range(notes))
+    db.executemany(f"INSERT INTO {database.NotesDatabase.DATABASE_NAME} (user_id, subject_id, content, due_date, reminded_times, is_completed) VALUES (?, ?, ?, ?, ?, ?)", rows)
+    db.commit()
+    db.close()
+
+def measure(notes_database: database.NotesDatabase, users: int, queries: int) -> dict[str, float]:
+    user_ids = [random.randrange(users) for _ in range(queries)]
+    results = {}
+
+    for name, query in (("get_notes_by_user_id", notes_database.get_notes_by_user_id),
+                        ("get_current_notes_by_user_id", notes_database.get_current_notes_by_user_id)):
+        started = time.perf_counter()
+        for user_id in user_ids:
+            list(query(user_id)[1])
+        results[name] = (time.perf_counter() - started) / queries * 1000
+
+    started = time.perf_counter()
+    list(notes_database.get_current_notes()[1])
+    results["get_current_notes"] = (time.perf_counter() - started) * 1000
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--notes', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        constants.NOTES_DATABASE_PATH = str(pathlib.Path(directory) / 'notes.db')
+
+        started = time.perf_counter()
+        populate(pathlib.Path(constants.NOTES_DATABASE_PATH), args.notes, args.users)
+        print(f"Inserted {args.notes} notes of {args.users} users in {time.perf_counter() - started:.1f} s")
+
+        notes_database = database.NotesDatabase.__new__(database.NotesDatabase)
+        notes_database.lock = database.threading.Lock()
+        notes_database.db = database.sqlite3.connect(constants.NOTES_DATABASE_PATH)
+        notes_database.cur = notes_database.db.cursor()
+        before = measure(notes_database, args.users, args.queries)
+        notes_database.close()
+
+        started = time.perf_counter()
+        notes_database = database.NotesDatabase()
+        print(f"Migrated in {time.perf_counter() - started:.1f} s")
+        after = measure(notes_database, args.users, args.queries)
+        notes_database.close()
+
+    print(f"{'query':<30} {'before, ms':>12} {'after, ms':>12}")
+    for name in before:
+        print(f"{name:<30} {before[name]:>12.3f} {after[name]:>12.3f}")
+
+if __name__ == '__main__':
+    main()
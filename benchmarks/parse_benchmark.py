@@ -0,0 +1,152 @@
+"""Compares parser backends on saved pages of the university site.
+
+Record fixtures once:  python benchmarks/parse_benchmark.py --record <group id> [<group id> ...]
+Run the benchmark:     python benchmarks/parse_benchmark.py [--repeat N]
+
+fixtures/schedule_synthetic.html and fixtures/groups_synthetic.html are generated pages in the layout of the site,
+written by --synthetic DAYS.
+"""
+import argparse
+import pathlib
+import random
+import sys
+import timeit
+from datetime import date, timedelta
+
+import requests
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import parse
+
+FIXTURES_DIR = pathlib.Path(__file__).resolve().parent / 'fixtures'
+SUBGROUPS = (None, 1, 2)
+
+def fetch(url: str) -> bytes:
+    res = requests.get(url, headers={'User-Agent': parse.USER_AGENT}, timeout=parse.REQUEST_TIMEOUT)
+    res.raise_for_status()
+    return res.content
+
+def record(group_ids: list[str]):
+    FIXTURES_DIR.mkdir(exist_ok=True)
+    
+    (FIXTURES_DIR / 'groups.html').write_bytes(fetch(parse.GROUPS_URL))
+    print("Saved groups.html")
+    
+    for group_id in group_ids:
+        (FIXTURES_DIR / f'schedule_{group_id}.html').write_bytes(fetch(parse.schedule_url(group_id)))
+        print(f"Saved schedule_{group_id}.html")
+
+def synthetic(days: int):
+    synthetic_schedule(days)
+    synthetic_groups()
+
+def synthetic_groups():
+    rng = random.Random(0)
+    stages = ("бакалавриат", "магистратура", "специалитет")
+    
+    faculties = []
+    group_id = 10000
+    for faculty in range(20):
+        forms = []
+        for form in ("очная форма обучения", "заочная форма обучения"):
+            items = []
+            for _ in range(rng.randrange(10, 40)):
+                group_id += rng.randrange(1, 20)
+                stage = rng.choice(stages)
+                course = rng.randrange(1, 5)
+                items.append(f"<li><div><button onclick=\"location.href='/static/schedule_view.php?id_group={group_id}&amp;sem=1'\">расписание</button></div>"
+                             f"{stage}, {course} курс, группа {course}об_ГР-{rng.randrange(1, 30)}</li>")
+            forms.append(f"<h4>{form}</h4><ul>{''.join(items)}</ul>")
+        faculties.append(f"<h3>Институт {faculty}</h3><div>{''.join(forms)}</div>")
+    
+    page = ("<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>Расписание</title></head><body>"
+            "<h1>Расписание занятий</h1>" + "\n".join(faculties) + "</body></html>")
+    FIXTURES_DIR.mkdir(exist_ok=True)
+    (FIXTURES_DIR / 'groups_synthetic.html').write_text(page, encoding='utf-8')
+    print(f"Saved groups_synthetic.html with {len(faculties)} faculties")
+
+def synthetic_schedule(days: int):
+    # Same seed, same page: the committed fixture can be regenerated
+    rng = random.Random(days)
+    times = ("8:30 — 10:00", "10:10 — 11:40", "12:10 — 13:40", "13:50 — 15:20", "15:30 — 17:00")
+    weekdays = ("понедельник", "вторник", "среда", "четверг", "пятница", "суббота", "воскресенье")
+    
+    def cell() -> str:
+        name = f"Дисциплина {rng.randrange(12)}"
+        kind = rng.choice(("лекция", "практические занятия", "лабораторные занятия"))
+        mod = rng.choice(("(01.09—30.12)", "(01.09—30.12) * дистанционное обучение", "(только 15.09)"))
+        if "дистанционное" in mod:
+            return f"<td><strong>{name}</strong> [{kind}]<br>{mod} <a href=\"https://moodle.herzen.spb.ru\">Курс</a></td>"
+        return (f"<td><strong>{name}</strong> [{kind}]<br>{mod} <a href=\"/static/teacher.php?id={rng.randrange(400)}\">Преподаватель {rng.randrange(400)}</a>, "
+                f"ауд. {rng.randrange(300)}<br></td>")
+    
+    rows = []
+    start = date(2026, 9, 1)
+    for day in (start + timedelta(days=i) for i in range(days)):
+        if day.weekday() == 6:
+            continue
+        rows.append(f"<tr><th class=\"dayname\" colspan=\"3\">{day:%d.%m.%Y}, {weekdays[day.weekday()]}</th></tr>")
+        for pair in sorted(rng.sample(range(len(times)), rng.randrange(2, 5))):
+            cells = cell() + cell() if rng.random() < 0.3 else cell()
+            rows.append(f"<tr><th>{times[pair]}</th>{cells}</tr>")
+    
+    page = ("<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>Расписание</title></head><body>"
+            "<h1>Расписание занятий</h1><table class=\"schedule\"><thead><tr><th>Время</th><th>Занятие</th></tr></thead><tbody>"
+            + "\n".join(rows) + "</tbody></table></body></html>")
+    FIXTURES_DIR.mkdir(exist_ok=True)
+    (FIXTURES_DIR / 'schedule_synthetic.html').write_text(page, encoding='utf-8')
+    print(f"Saved schedule_synthetic.html with {len(rows)} rows")
+
+def measure(func, repeat: int) -> float:
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+def bench(repeat: int) -> bool:
+    ok = True
+    
+    schedule_pages = sorted(FIXTURES_DIR.glob('schedule_*.html'))
+    groups_pages = sorted(FIXTURES_DIR.glob('groups*.html'))
+    # PARSER_BACKEND switches both parsers, so both kinds of pages have to be checked
+    if len(schedule_pages) == 0 or len(groups_pages) == 0:
+        print(f"Missing schedule or groups fixtures in {FIXTURES_DIR}, record some with --record or --synthetic")
+        return False
+    
+    for groups_page in groups_pages:
+        content = groups_page.read_bytes()
+        reference = parse.parse_groups_page(content, "html.parser")
+        if not reference:
+            print(f"{groups_page.name}: no faculties parsed")
+            ok = False
+        for backend in parse.PARSER_BACKENDS:
+            equal = parse.parse_groups_page(content, backend) == reference
+            ok &= equal
+            seconds = measure(lambda: parse.parse_groups_page(content, backend), repeat)
+            print(f"{groups_page.name:<32} {backend:<12} {seconds * 1000:8.2f} ms  {'equal' if equal else 'DIFFERENT'}")
+    
+    for page in schedule_pages:
+        content = page.read_bytes()
+        references = {subgroup: parse.parse_schedule_page(content, subgroup, "html.parser") for subgroup in SUBGROUPS}
+        if not references[None]:
+            print(f"{page.name}: no classes parsed")
+            ok = False
+        for backend in parse.PARSER_BACKENDS:
+            equal = all(parse.parse_schedule_page(content, subgroup, backend) == reference for subgroup, reference in references.items())
+            ok &= equal
+            seconds = measure(lambda: parse.parse_schedule_page(content, None, backend), repeat)
+            print(f"{page.name:<32} {backend:<12} {seconds * 1000:8.2f} ms  {'equal' if equal else 'DIFFERENT'}")
+            
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--record', nargs='+', metavar='GROUP_ID', help="fetch and save pages of the given groups")
+    parser.add_argument('--synthetic', type=int, metavar='DAYS', help="generate a schedule page of the given number of days")
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    
+    if args.record:
+        record(args.record)
+    elif args.synthetic:
+        synthetic(args.synthetic)
+    elif not bench(args.repeat):
+        sys.exit(1)
@@ -0,0 +1,73 @@
+"""Compares the memory used by cached schedules of every group as ScheduleSubject lists and as compact GroupSchedule indices.
+
+Run the benchmark:  python benchmarks/schedule_memory_benchmark.py [--groups N] [--days N]
+"""
+import argparse
+import gc
+import pathlib
+import random
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import database
+import parse
+import utils
+
+MODES = ('subjects', 'compact')
+
+def rss() -> int:
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * 4096
+
+def generate(group: int, days: int) -> list[parse.ScheduleSubject]:
+    # Strings come from separately built objects, like after parsing separate pages
+    rng = random.Random(group)
+    start = datetime(2026, 9, 1, 9, 0, tzinfo=utils.DEFAULT_TIMEZONE)
+    subjects = []
+    for day in range(days):
+        if (start + timedelta(days=day)).weekday() == 6:
+            continue
+        for pair in range(rng.randrange(2, 5)):
+            time_start = start + timedelta(days=day, minutes=pair * 100)
+            subjects.append(parse.ScheduleSubject(time_start=time_start, time_end=time_start + timedelta(minutes=90),
+                                                  mod=''.join(['']), name=''.join(['Дисциплина ', str(rng.randrange(12))]),
+                                                  type=''.join(['лекция' if pair % 2 else 'практика']),
+                                                  teacher=''.join(['Преподаватель ', str(rng.randrange(400))]),
+                                                  room=''.join(['ауд. ', str(rng.randrange(300))])))
+    return subjects
+
+def measure(mode: str, groups: int, days: int):
+    gc.collect()
+    before = rss()
+
+    schedules = {}
+    classes = 0
+    for group in range(groups):
+        subjects = generate(group, days)
+        classes += len(subjects)
+        schedules[group] = subjects if mode == 'subjects' else database.GroupSchedule.from_subjects(subjects)
+        del subjects
+
+    gc.collect()
+    print(f"{mode:<10} {groups} groups, {classes} classes: {(rss() - before) / 2 ** 20:.1f} MiB")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--groups', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=120)
+    parser.add_argument('--mode', choices=MODES)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        measure(args.mode, args.groups, args.days)
+        return
+
+    # Every mode runs in a fresh interpreter so that freed memory does not skew the next one
+    for mode in MODES:
+        subprocess.run([sys.executable, __file__, '--mode', mode, '--groups', str(args.groups), '--days', str(args.days)], check=True)
+
+if __name__ == '__main__':
+    main()
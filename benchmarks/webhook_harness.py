@@ -0,0 +1,85 @@
+"""Posts fake updates to a bot running in webhook mode and reports how long the webhook takes to accept them.
+
+Start the bot with WEBHOOK_URL, WEBHOOK_SECRET and WEBHOOK_PORT set, then run:
+    python benchmarks/webhook_harness.py --secret <secret> [--url http://127.0.0.1:8080] [--updates N] [--concurrency N]
+
+Replies of the bot go to the fake chat and fail, the handlers still run end to end up to that point.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+
+def fake_update(update_id: int, user_id: int, text: str) -> dict:
+    user = {'id': user_id, 'is_bot': False, 'first_name': 'Harness'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': 'Harness'},
+            'from': user,
+            'text': text,
+        },
+    }
+
+async def check(session: aiohttp.ClientSession, args) -> bool:
+    ok = True
+
+    async with session.get(f"{args.url}/health") as res:
+        print(f"GET /health: {res.status} {await res.text()}")
+        ok &= res.status == 200
+
+    async with session.post(f"{args.url}{args.path}", json=fake_update(0, args.user, "/menu"),
+                            headers={'X-Telegram-Bot-Api-Secret-Token': args.secret + 'x'}) as res:
+        print(f"POST with a wrong secret: {res.status}")
+        ok &= res.status == 401
+
+    return ok
+
+async def load(session: aiohttp.ClientSession, args) -> list[float]:
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: list[float] = []
+
+    async def post(update_id: int):
+        async with semaphore:
+            started = time.perf_counter()
+            async with session.post(f"{args.url}{args.path}", json=fake_update(update_id, args.user + update_id % args.users, args.text),
+                                    headers={'X-Telegram-Bot-Api-Secret-Token': args.secret}) as res:
+                await res.read()
+                if res.status != 200:
+                    print(f"Update {update_id}: {res.status}")
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(post(i) for i in range(1, args.updates + 1)))
+    return latencies
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--path', default='/webhook')
+    parser.add_argument('--secret', required=True)
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=40)
+    parser.add_argument('--user', type=int, default=10 ** 9)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--text', default='/menu')
+    args = parser.parse_args()
+
+    async with aiohttp.ClientSession() as session:
+        if not await check(session, args):
+            print("Checks failed")
+            return
+
+        started = time.perf_counter()
+        latencies = sorted(await load(session, args))
+        elapsed = time.perf_counter() - started
+
+    print(f"{len(latencies)} updates in {elapsed:.2f} s ({len(latencies) / elapsed:.0f}/s)")
+    print(f"latency ms: median {statistics.median(latencies) * 1000:.1f}, "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f}, max {latencies[-1] * 1000:.1f}")
+
+if __name__ == '__main__':
+    asyncio.run(main())
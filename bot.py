@@ -6,7 +6,9 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.enums.parse_mode import ParseMode
 from aiogram import types
 
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Callable
 import logging
 import dotenv
 import os
@@ -16,9 +18,18 @@ from handlers import base_handler, register_handler, configure_user_handler, \
                         reminder_edit_handler
 
 import utils
+import dateformat
+import constants
 import database
 import models
 import callbacks
+import reminders
+import notifications
+import parse
+import middlewares
+import webhook
+import storage
+import sharding
 
 dotenv.load_dotenv()
 
@@ -26,17 +37,78 @@ logger = logging.getLogger(__name__)
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
+# Updates are received through a webhook when its public URL is set, otherwise by long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+
+NOTIFICATION_WORKERS = int(os.getenv("NOTIFICATION_WORKERS", 8))
+SCHEDULE_MAX_AGE = timedelta(hours=6)
+SCHEDULE_CACHE_ENTRIES = int(os.getenv("SCHEDULE_CACHE_ENTRIES", 2000))
+SCHEDULE_CACHE_BYTES = int(os.getenv("SCHEDULE_CACHE_MB", 64)) * 2 ** 20
+PREFETCH_WINDOW = os.getenv("PREFETCH_WINDOW", "05:00-07:00")
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", 4))
+PARSER_BACKEND = os.getenv("PARSER_BACKEND", parse.DEFAULT_PARSER_BACKEND)
+PARSER_EXECUTOR = os.getenv("PARSER_EXECUTOR", "process")
+PARSER_WORKERS = int(os.getenv("PARSER_WORKERS", 0)) or None
+PARSER_MAX_PENDING = int(os.getenv("PARSER_MAX_PENDING", 0)) or None
+SCHEDULE_REFRESH_INTERVAL = timedelta(hours=int(os.getenv("SCHEDULE_REFRESH_INTERVAL_HOURS", 3)))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = timedelta(seconds=int(os.getenv("USER_CACHE_TTL", 600)))
+NOTES_WRITE_BEHIND = os.getenv("NOTES_WRITE_BEHIND", "0") == "1"
+NOTES_FLUSH_INTERVAL = timedelta(milliseconds=int(os.getenv("NOTES_FLUSH_INTERVAL_MS", 200)))
+NOTES_FLUSH_OPS = int(os.getenv("NOTES_FLUSH_OPS", 100))
+# Conversations are kept on disk by default so that a restart does not interrupt them
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_TTL = timedelta(hours=int(os.getenv("FSM_TTL_HOURS", 24)))
+FSM_PURGE_INTERVAL = timedelta(hours=1)
+# Several workers can share the users, split into partitions by user id, through the databases in a common directory
+SHARDING = os.getenv("SHARDING", "0") == "1"
+SHARD_PARTITIONS = int(os.getenv("SHARD_PARTITIONS", 64))
+# A stable id lets a restarted worker take back the reminders it had claimed right away
+WORKER_ID = os.getenv("WORKER_ID") or (sharding.default_worker_id() if SHARDING else "main")
+
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 
-async def update_groups_and_clear_schedules(time: str, groups_database: database.GroupsDatabase, schedules_database: database.SchedulesDatabase):
+async def update_groups(time: str, groups_database: database.GroupsDatabase):
     while True:
-        logger.info("Fetching groups and schedules...")
-        groups_database.fetch_groups()
-        schedules_database.clear_subjects()
-        logging.info("Successfully fetched groups and schedules")
+        logger.info("Fetching groups...")
+        await groups_database.fetch_groups()
+        logging.info("Successfully fetched groups")
         await asyncio.sleep(utils.seconds_before_time(time))
 
-async def send_notification(note: models.UserNote, now: datetime):
+async def prefetch_schedules(window: str, users_database: database.AsyncUsersDatabase, schedules_database: database.SchedulesDatabase):
+    window_start, window_end = window.split('-')
+    
+    # Right after startup only fetch what is missing or stale, everything else is served from the disk cache
+    groups = [group for group, _ in await users_database.get_groups_by_popularity()]
+    await schedules_database.prefetch_subjects(groups, PREFETCH_CONCURRENCY, max_age=SCHEDULE_MAX_AGE)
+    
+    while True:
+        await asyncio.sleep(utils.seconds_before_time(window_start))
+        deadline = utils.tz_now() + timedelta(seconds=utils.seconds_before_time(window_end))
+        
+        groups = [group for group, _ in await users_database.get_groups_by_popularity()]
+        await schedules_database.prefetch_subjects(groups, PREFETCH_CONCURRENCY, deadline=deadline)
+
+async def refresh_schedules(interval: timedelta, schedules_database: database.SchedulesDatabase):
+    while True:
+        await asyncio.sleep(interval.total_seconds())
+        await schedules_database.prefetch_subjects(schedules_database.cache.groups(), PREFETCH_CONCURRENCY, max_age=interval)
+
+async def purge_sessions(interval: timedelta, fsm_storage: storage.SQLiteStorage):
+    while True:
+        deleted, stats = await fsm_storage.purge()
+        logger.info(f"Purged {deleted} abandoned sessions, {stats.sessions} left: "
+                    f"{stats.avg_bytes:.0f} bytes on average, {stats.max_bytes} at most")
+        await asyncio.sleep(interval.total_seconds())
+
+async def send_notification(notification: notifications.Notification):
+    note = notification.note
+    now = utils.tz_now()
+    
     keyboard = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="✅ Отметить как «Выполненное»", callback_data=callbacks.NotificationCompleteCallback(note_id=note.id).pack())]], resize_keyboard=True)
     
     remaining_text = utils.seconds_to_text((note.due_date - now).total_seconds())
@@ -44,59 +116,126 @@ async def send_notification(note: models.UserNote, now: datetime):
     if note.subject_id is not None:
         await bot.send_message(note.user_id, text=f"📣 <b>Напоминание о дедлайне</b>\n\nПредмет: <b>{note.subject_id}</b>\nЗадание: \"{note.text}\"\n\nДо дедлайна осталось: <b>{remaining_text}</b>.", reply_markup=keyboard)
     else:
-        with utils.time_locale('ru_RU.UTF-8'):
-            date_text: str = note.due_date.strftime("%d %b %Y")
+        date_text: str = dateformat.day_month_year(note.due_date)
         await bot.send_message(note.user_id, text=f"📣 <b>Напоминание о дедлайне</b>\n\nЧерез <b>{remaining_text}</b> истечёт дедлайн по личной заметки:\n\"{note.text}\" к <b>{date_text}</b>.", reply_markup=keyboard)
 
-async def notify_of_reminders(notes_database: database.NotesDatabase, users_database: database.UsersDatabase):
-    while True:
-        logger.info("Checking reminders to notify...")
-        now = datetime.now(tz=utils.DEFAULT_TIMEZONE)
-        cache_users: dict[models.UserId, models.User] = {}
+async def on_notification_sent(notification: notifications.Notification, reminder_outbox: reminders.ReminderOutbox, reminder_scheduler: reminders.ReminderScheduler):
+    note = notification.note
+    await reminder_outbox.acknowledge(note, models.ReminderState.SENT)
+    await reminder_scheduler.update_note(note.id)
+    logger.info(f"Sent {note.reminded_times + 1} reminder to user '{note.user_id}'")
+
+async def on_notification_failed(notification: notifications.Notification, reminder_outbox: reminders.ReminderOutbox, reminder_scheduler: reminders.ReminderScheduler):
+    note = notification.note
+    if await reminder_outbox.retry(note):
+        logger.error(f"Failed to send {note.reminded_times + 1} reminder to user '{note.user_id}', it will be retried")
+        return
+    
+    logger.error(f"Gave up sending {note.reminded_times + 1} reminder to user '{note.user_id}'")
+    await reminder_scheduler.update_note(note.id)
+
+async def on_partitions_acquired(in_partitions: Callable[[models.UserId], bool], users_database: database.AsyncUsersDatabase, reminder_scheduler: reminders.ReminderScheduler):
+    # Another worker may have changed the profiles and notes of these users meanwhile
+    users_database.invalidate_where(in_partitions)
+    reminder_scheduler.remove_users_where(in_partitions)
+    await reminder_scheduler.load(in_partitions)
+
+async def on_partitions_released(in_partitions: Callable[[models.UserId], bool], notes_database: database.AsyncNotesDatabase, reminder_scheduler: reminders.ReminderScheduler):
+    reminder_scheduler.remove_users_where(in_partitions)
+    # The new owner reads the notes from the database
+    await notes_database.flush()
+
+async def check_reminders(note_ids: list[int], reminder_scheduler: reminders.ReminderScheduler, reminder_outbox: reminders.ReminderOutbox, notes_database: database.AsyncNotesDatabase, users_database: database.AsyncUsersDatabase):
+    logger.info(f"Checking {len(note_ids)} reminders to notify...")
+    now = datetime.now(tz=utils.DEFAULT_TIMEZONE)
+    expired = await notes_database.complete_expired_notes(now)
+    if expired > 0:
+        logger.info(f"Completed {expired} expired notes")
+    
+    exhausted: list[models.UserNote] = []
+    due: list[models.UserNote] = []
+    
+    for note in await notes_database.get_notes_by_ids(note_ids):
+        if note.is_completed:
+            continue
         
-        _, notes = notes_database.get_current_notes()
-        for note in notes:
-            if now >= note.due_date:
-                note.is_completed = True
-                notes_database.update_note(note)
-                continue
-            
-            if note.user_id not in cache_users:
-                cache_users[note.user_id] = users_database.get_user_by_id(note.user_id)
-                
-            user = cache_users[note.user_id]
-            
-            if user is None:
-                logger.error(f"Failed to check for reminders: user '{note.user_id}' not found")
-                continue
-            
-            if note.reminded_times >= sum((True for t in user.reminder_times if t is not None)):
-                note.is_completed = True
-            else:
-                reminder_time = user.reminder_times[note.reminded_times]
-                if now >= note.due_date - reminder_time.value:
-                    try:
-                        await send_notification(note, now)
-                        note.reminded_times += 1
-                        logger.info(f"Sent {note.reminded_times} reminder to user '{note.user_id}'")
-                    except Exception as e:
-                        logger.error(f"Failed to send {note.reminded_times} reminder to user '{note.user_id}': {e}")
-                    await asyncio.sleep(0.5)
-            
-            notes_database.update_note(note)
-
-        await asyncio.sleep(30)
-
-async def on_startup(groups_database: database.GroupsDatabase, schedules_database: database.SchedulesDatabase, users_database: database.UsersDatabase, notes_database: database.NotesDatabase):
-    await bot.delete_webhook(drop_pending_updates=True)
-    
-    loop = asyncio.get_event_loop()
-    loop.create_task(update_groups_and_clear_schedules('00:00', groups_database=groups_database, schedules_database=schedules_database))
-    loop.create_task(notify_of_reminders(users_database=users_database, notes_database=notes_database))
-    
-async def on_shutdown(users_database: database.UsersDatabase, notes_database: database.NotesDatabase):
-    users_database.close()
-    notes_database.close()
+        user = await users_database.get_user_by_id(note.user_id)
+        if user is None:
+            logger.error(f"Failed to check for reminders: user '{note.user_id}' not found")
+            continue
+        
+        if note.reminded_times >= sum((True for t in user.reminder_times if t is not None)):
+            note.is_completed = True
+            exhausted.append(note)
+            continue
+        
+        reminder_time = user.reminder_times[note.reminded_times]
+        if now >= note.due_date - reminder_time.value:
+            # The note is scheduled again once the reminder is sent or given up
+            due.append(note)
+        else:
+            reminder_scheduler.schedule(note, user)
+    
+    if len(due) > 0:
+        await reminder_outbox.enqueue(due)
+    
+    if len(exhausted) > 0:
+        await notes_database.update_notes_state(exhausted)
+
+async def notify_of_reminders(reminder_scheduler: reminders.ReminderScheduler, reminder_outbox: reminders.ReminderOutbox, notes_database: database.AsyncNotesDatabase, users_database: database.AsyncUsersDatabase, coordinator: sharding.Coordinator | None):
+    # With sharding the notes are loaded partition by partition as the leases are acquired
+    loaded = coordinator is not None
+    note_ids: list[int] = []
+    
+    while True:
+        try:
+            if not loaded:
+                await reminder_scheduler.load()
+                loaded = True
+            # Notes of a failed check are out of the scheduler's heap, they are checked again instead of being lost
+            if len(note_ids) == 0:
+                note_ids = await reminder_scheduler.wait_due()
+            await check_reminders(note_ids, reminder_scheduler, reminder_outbox, notes_database, users_database)
+            note_ids = []
+        except Exception as e:
+            logger.exception(f"Failed to check reminders, retrying in {reminders.ERROR_BACKOFF} s: {e}")
+            await asyncio.sleep(reminders.ERROR_BACKOFF)
+
+async def on_startup(dispatcher: Dispatcher, coordinator: sharding.Coordinator | None, groups_database: database.GroupsDatabase, schedules_database: database.SchedulesDatabase, users_database: database.AsyncUsersDatabase, notes_database: database.AsyncNotesDatabase, reminder_scheduler: reminders.ReminderScheduler, reminder_outbox: reminders.ReminderOutbox, notification_dispatcher: notifications.NotificationDispatcher, background_tasks: list[asyncio.Task]):
+    if not WEBHOOK_URL:
+        # Sharded workers share Telegram's queue, a worker that joins must not throw away updates the others have not fetched yet
+        await bot.delete_webhook(drop_pending_updates=coordinator is None)
+    
+    notification_dispatcher.start()
+    notes_database.start()
+    
+    # Kept to be stopped on shutdown, before the databases they use are closed
+    background_tasks.extend([
+        asyncio.create_task(update_groups('00:00', groups_database=groups_database)),
+        asyncio.create_task(prefetch_schedules(PREFETCH_WINDOW, users_database=users_database, schedules_database=schedules_database)),
+        asyncio.create_task(refresh_schedules(SCHEDULE_REFRESH_INTERVAL, schedules_database=schedules_database)),
+        asyncio.create_task(notify_of_reminders(reminder_scheduler=reminder_scheduler, reminder_outbox=reminder_outbox, users_database=users_database, notes_database=notes_database, coordinator=coordinator)),
+        asyncio.create_task(reminder_outbox.drain(notification_dispatcher)),
+    ])
+    if coordinator is not None:
+        coordinator.start(dispatcher, bot, poll=not WEBHOOK_URL)
+    if isinstance(dispatcher.storage, storage.SQLiteStorage):
+        background_tasks.append(asyncio.create_task(purge_sessions(FSM_PURGE_INTERVAL, fsm_storage=dispatcher.storage)))
+    
+async def on_shutdown(coordinator: sharding.Coordinator | None, users_database: database.AsyncUsersDatabase, notes_database: database.AsyncNotesDatabase, schedules_database: database.SchedulesDatabase, notification_dispatcher: notifications.NotificationDispatcher, parser_pool: parse.ParserPool, background_tasks: list[asyncio.Task]):
+    if coordinator is not None:
+        await coordinator.close()
+    # No new reminders are claimed from here on, the ones being sent are finished by the dispatcher
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    await notification_dispatcher.close()
+    await parse.http_client.close()
+    parser_pool.close()
+    await schedules_database.close()
+    await users_database.close()
+    await notes_database.close()
     
 async def main():
     logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
@@ -119,13 +258,56 @@ async def main():
     reminder_creation_handler.register(reminder_creation_router)
     reminder_edit_handler.register(reminder_edit_router)
     
+    users_database = database.AsyncUsersDatabase(database.UsersDatabase(), cache_size=USER_CACHE_SIZE, cache_ttl=USER_CACHE_TTL)
+    notes_database = database.AsyncNotesDatabase(database.NotesDatabase(), write_behind=NOTES_WRITE_BEHIND, flush_interval=NOTES_FLUSH_INTERVAL, flush_ops=NOTES_FLUSH_OPS)
+    reminder_scheduler = reminders.ReminderScheduler(notes_database=notes_database, users_database=users_database)
+    parser_pool = parse.ParserPool(executor=PARSER_EXECUTOR, workers=PARSER_WORKERS, max_pending=PARSER_MAX_PENDING, backend=PARSER_BACKEND)
+    
+    coordinator = None
+    if SHARDING:
+        if FSM_STORAGE != "sqlite":
+            raise RuntimeError("Workers can only share conversations kept in the SQLite FSM storage")
+        coordinator = sharding.Coordinator(
+            sharding.ShardDatabase(constants.SHARDS_DATABASE_PATH, SHARD_PARTITIONS),
+            worker_id=WORKER_ID,
+            on_acquired=partial(on_partitions_acquired, users_database=users_database, reminder_scheduler=reminder_scheduler),
+            on_released=partial(on_partitions_released, notes_database=notes_database, reminder_scheduler=reminder_scheduler)
+        )
+        logger.info(f"Running as worker '{WORKER_ID}' of {SHARD_PARTITIONS} partitions")
+    
+    # With sharding a worker only claims reminders of the users it owns
+    reminder_outbox = reminders.ReminderOutbox(notes_database=notes_database, users_database=users_database, worker_id=WORKER_ID,
+                                               owns=coordinator.owns_user if coordinator is not None else None)
+    
+    notification_dispatcher = notifications.NotificationDispatcher(
+        send=send_notification,
+        on_sent=partial(on_notification_sent, reminder_outbox=reminder_outbox, reminder_scheduler=reminder_scheduler),
+        on_failed=partial(on_notification_failed, reminder_outbox=reminder_outbox, reminder_scheduler=reminder_scheduler),
+        workers=NOTIFICATION_WORKERS
+    )
+    
+    # The storage is closed by the dispatcher on shutdown
+    fsm_storage = storage.SQLiteStorage(constants.FSM_DATABASE_PATH, ttl=FSM_TTL) if FSM_STORAGE == "sqlite" else None
+    
     dp = Dispatcher(
-        groups_database=database.GroupsDatabase(),
-        schedules_database=database.SchedulesDatabase(),
-        users_database=database.UsersDatabase(),
-        notes_database=database.NotesDatabase()
+        storage=fsm_storage,
+        groups_database=database.GroupsDatabase(parser_pool=parser_pool),
+        schedules_database=database.SchedulesDatabase(database.ScheduleCacheDatabase(), parser_pool=parser_pool,
+                                                      cache=database.ScheduleCache(SCHEDULE_CACHE_ENTRIES, SCHEDULE_CACHE_BYTES, SCHEDULE_MAX_AGE)),
+        parser_pool=parser_pool,
+        users_database=users_database,
+        notes_database=notes_database,
+        reminder_scheduler=reminder_scheduler,
+        reminder_outbox=reminder_outbox,
+        notification_dispatcher=notification_dispatcher,
+        coordinator=coordinator,
+        background_tasks=[]
     )
     
+    dp.update.outer_middleware(middlewares.UserMiddleware())
+    dp.message.middleware(middlewares.RegisteredUserMiddleware())
+    dp.callback_query.middleware(middlewares.RegisteredUserMiddleware())
+    
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
     dp.include_router(registration_router)
@@ -143,7 +325,15 @@ async def main():
     ]
     await bot.set_my_commands(commands)
     
-    await dp.start_polling(bot)
+    if WEBHOOK_URL:
+        if not WEBHOOK_SECRET:
+            raise RuntimeError("WEBHOOK_SECRET must be set to receive updates through a webhook")
+        await webhook.run_webhook(dp, bot, url=WEBHOOK_URL, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET, host=WEBHOOK_HOST, port=WEBHOOK_PORT, coordinator=coordinator)
+    elif coordinator is not None:
+        # Only the worker holding the intake lease polls, the updates reach the others through the shared queue
+        await sharding.run_worker(dp, bot)
+    else:
+        await dp.start_polling(bot)
     
 if __name__ == "__main__":
     asyncio.run(main())
@@ -7,4 +7,10 @@ class NotificationCompleteCallback(CallbackData, prefix="nt-cmplt"):
     note_id: int
     
 class NoteEditCallback(CallbackData, prefix="nt-edit"):
-    note_id: int
\ No newline at end of file
+    note_id: int
+    
+class NotesPageCallback(CallbackData, prefix="nt-page"):
+    # The first or last note of the shown page, 0 for the first page
+    cursor: int
+    forward: bool
+    completed: bool
\ No newline at end of file
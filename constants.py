@@ -1,4 +1,7 @@
 BOT_NAME = "Herzen Organizer"
 
 USERS_DATABASE_PATH = './databases/users.db'
-NOTES_DATABASE_PATH = './databases/notes.db'
\ No newline at end of file
+NOTES_DATABASE_PATH = './databases/notes.db'
+SCHEDULES_DATABASE_PATH = './databases/schedules.db'
+FSM_DATABASE_PATH = './databases/sessions.db'
+SHARDS_DATABASE_PATH = './databases/shards.db'
\ No newline at end of file
@@ -1,64 +1,531 @@
 import parse
+import asyncio
 import threading
 import models
 import sqlite3
+import hashlib
+import bisect
+import sys
+import time
+from collections import OrderedDict
+from array import array
+import json
+import logging
+import dataclasses
+import cachetools
+from dataclasses import dataclass
 from datetime import timedelta, datetime, date
 
-from typing import Iterable, Optional, Generator
+from typing import Any, Iterable, Optional, AsyncGenerator, Callable, TypeVar
+from concurrent.futures import ThreadPoolExecutor
 
-from contextlib import contextmanager
+from contextlib import asynccontextmanager
 
 import constants
 import utils
 
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Sharded workers write the same files, a writer waits this many seconds for another one's lock
+BUSY_TIMEOUT = 30
+
+class DatabaseThread:
+    """Runs blocking database calls one by one on a dedicated thread, off the event loop."""
+    
+    def __init__(self, name: str):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        
+    async def run(self, func: Callable[..., T], *args) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+    
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+def configure_connection(db: sqlite3.Connection):
+    # WAL lets readers proceed while a write is in progress; NORMAL is durable across crashes of the process
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute("PRAGMA synchronous = NORMAL")
+    db.execute("PRAGMA cache_size = -16384")
+    db.execute("PRAGMA temp_store = MEMORY")
+
+def migrate(db: sqlite3.Connection, name: str, migrations: list[str]):
+    """Applies the migrations that are newer than the schema version stored in the database file."""
+    version = db.execute("PRAGMA user_version").fetchone()[0]
+    for number, script in enumerate(migrations[version:], start=version + 1):
+        logger.info(f"Migrating {name} database to version {number}")
+        db.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;")
+
 class GroupsDatabase:
-    def __init__(self):
+    def __init__(self, parser_pool: parse.ParserPool):
         self.groups: list[parse.ScheduleFaculty] = []
-        self.lock = threading.Lock()
+        self.lock = asyncio.Lock()
+        self.parser_pool = parser_pool
         
-    def fetch_groups(self):
-        with self.lock:
-            self.groups = parse.parse_groups() or []
+    async def fetch_groups(self):
+        async with self.lock:
+            content = await parse.http_client.get(parse.GROUPS_URL)
+            if content is not None:
+                self.groups = await self.parser_pool.parse_groups_page(content) or self.groups
         
-    @contextmanager    
-    def get_groups(self):
+    @asynccontextmanager
+    async def get_groups(self) -> AsyncGenerator[list[parse.ScheduleFaculty]]:
         if len(self.groups) == 0:
-            self.fetch_groups()
+            await self.fetch_groups()
         
-        self.lock.acquire()
-        try:
-            yield self.groups
-        finally:
-            self.lock.release()
+        yield self.groups
             
-class SchedulesDatabase:
+class StringTable:
+    """Keeps one copy of every distinct string, cached schedules refer to them by index.
+    
+    Schedules are built both on the event loop and in the thread of the cache database, so new strings are added under a lock.
+    """
+    
     def __init__(self):
-        self.schedules: dict[models.UserGroup, list[parse.ScheduleSubject]] = {}
+        self.strings: list[str] = []
+        self.ids: dict[str, int] = {}
         self.lock = threading.Lock()
         
-    def clear_subjects(self):
-        with self.lock:
-            self.schedules.clear()
+    def intern(self, string: str) -> int:
+        id = self.ids.get(string)
+        if id is None:
+            with self.lock:
+                id = self.ids.get(string)
+                if id is None:
+                    # The string is in the list before its id can be seen
+                    id = len(self.strings)
+                    self.strings.append(string)
+                    self.ids[string] = id
+        return id
+    
+    def __getitem__(self, id: int) -> str:
+        return self.strings[id]
+
+# Teachers, rooms and subject names repeat across groups, so the table is shared by all schedules
+SCHEDULE_STRINGS = StringTable()
+
+class GroupSchedule:
+    """Classes of a group ordered by their end, stored column-wise and searched by binary search.
+    
+    Times are kept in epoch minutes and strings as indices into SCHEDULE_STRINGS,
+    ScheduleSubject objects are only built for the classes that are asked for.
+    """
+    
+    def __init__(self, rows: Iterable[list]):
+        """Builds the index from rows in the format of ScheduleCacheDatabase.subject_to_row."""
+        rows = sorted(rows, key=lambda row: row[1])
+        self.starts = array('i', (row[0] // 60 for row in rows))
+        self.ends = array('i', (row[1] // 60 for row in rows))
+        self.mods = array('I', (SCHEDULE_STRINGS.intern(row[2]) for row in rows))
+        self.names = array('I', (SCHEDULE_STRINGS.intern(row[3]) for row in rows))
+        self.types = array('I', (SCHEDULE_STRINGS.intern(row[4]) for row in rows))
+        self.teachers = array('I', (SCHEDULE_STRINGS.intern(row[5]) for row in rows))
+        self.rooms = array('I', (SCHEDULE_STRINGS.intern(row[6]) for row in rows))
+        self.max_duration = max((end - start for start, end in zip(self.starts, self.ends)), default=0)
         
-    @contextmanager    
-    def get_subjects(self, group: models.UserGroup, date_from: date | None = None, date_to: date | None = None) -> Generator[list[parse.ScheduleSubject] | None]:
-        self.lock.acquire()
-        try:
-            if group not in self.schedules:
-                schedules = parse.parse_schedule(group.id, group.subgroup, date_from, date_to)
-                if schedules is not None:
-                    self.schedules[group] = schedules
-            yield self.schedules.get(group)
-        finally:
-            self.lock.release()
+        # Subject name -> ordinals of the days it is held on, and its first class on each of them
+        self.occurrence_days: dict[int, array] = {}
+        self.occurrences: dict[int, array] = {}
+        for i, (start, name) in enumerate(zip(self.starts, self.names)):
+            day = datetime.fromtimestamp(start * 60, tz=utils.DEFAULT_TIMEZONE).toordinal()
+            days = self.occurrence_days.get(name)
+            if days is None:
+                days = self.occurrence_days[name] = array('i')
+                self.occurrences[name] = array('I')
+            if len(days) == 0 or days[-1] != day:
+                days.append(day)
+                self.occurrences[name].append(i)
+                
+    def size(self) -> int:
+        """Approximate memory taken by the index, the shared string table is not counted."""
+        columns = (self.starts, self.ends, self.mods, self.names, self.types, self.teachers, self.rooms)
+        return (sys.getsizeof(self) + sum(map(sys.getsizeof, columns))
+                + sys.getsizeof(self.occurrence_days) + sum(map(sys.getsizeof, self.occurrence_days.values()))
+                + sys.getsizeof(self.occurrences) + sum(map(sys.getsizeof, self.occurrences.values())))
+    
+    def from_subjects(subjects: Iterable[parse.ScheduleSubject]) -> 'GroupSchedule':
+        return GroupSchedule(map(ScheduleCacheDatabase.subject_to_row, subjects))
+    
+    def __len__(self) -> int:
+        return len(self.ends)
+    
+    def row(self, i: int) -> list:
+        return [self.starts[i] * 60, self.ends[i] * 60, SCHEDULE_STRINGS[self.mods[i]], SCHEDULE_STRINGS[self.names[i]],
+                SCHEDULE_STRINGS[self.types[i]], SCHEDULE_STRINGS[self.teachers[i]], SCHEDULE_STRINGS[self.rooms[i]]]
+    
+    def rows(self) -> list[list]:
+        return [self.row(i) for i in range(len(self))]
+    
+    def subject(self, i: int) -> parse.ScheduleSubject:
+        return ScheduleCacheDatabase.row_to_subject(self.row(i))
+    
+    def subjects(self) -> list[parse.ScheduleSubject]:
+        return [self.subject(i) for i in range(len(self))]
+    
+    def subject_names(self) -> list[str]:
+        return [SCHEDULE_STRINGS[name] for name in self.occurrences]
+        
+    def current(self, moment: datetime, before: timedelta = timedelta(minutes=3), after: timedelta = timedelta(minutes=7)) -> parse.ScheduleSubject | None:
+        """Returns the class that goes on at the moment, counting a few minutes before its start and after its end."""
+        t = moment.timestamp() / 60
+        before_minutes = before.total_seconds() / 60
+        i = bisect.bisect_left(self.ends, t - after.total_seconds() / 60)
+        # Classes further on start later than the moment even if they are the longest ones
+        last_end = t + before_minutes + self.max_duration
+        while i < len(self) and self.ends[i] <= last_end:
+            if self.starts[i] - before_minutes <= t:
+                return self.subject(i)
+            i += 1
+        return None
+    
+    def last_finished(self, moment: datetime) -> parse.ScheduleSubject | None:
+        i = bisect.bisect_right(self.ends, moment.timestamp() / 60)
+        return self.subject(i - 1) if i > 0 else None
+    
+    def next_occurrences(self, name: str, after: date, count: int) -> list[parse.ScheduleSubject]:
+        """Returns the first classes of the subject on each of the next `count` days it is held after the given date."""
+        name_id = SCHEDULE_STRINGS.ids.get(name)
+        days = self.occurrence_days.get(name_id)
+        if days is None:
+            return []
+        i = bisect.bisect_right(days, after.toordinal())
+        return [self.subject(j) for j in self.occurrences[name_id][i:i + count]]
 
-class UsersDatabase:
+@dataclass(frozen=True)
+class CachedSchedule:
+    index: GroupSchedule
+    date_from: date | None
+    date_to: date | None
+    fetched_at: datetime
+    content_hash: str
+    etag: str | None = None
+    last_modified: str | None = None
+    
+    @property
+    def subjects(self) -> list[parse.ScheduleSubject]:
+        return self.index.subjects()
+
+@dataclass(frozen=True)
+class ScheduleDiff:
+    added: list[parse.ScheduleSubject]
+    removed: list[parse.ScheduleSubject]
+    
+    def between(old: list[parse.ScheduleSubject], new: list[parse.ScheduleSubject]) -> 'ScheduleDiff':
+        old_set = set(old)
+        new_set = set(new)
+        return ScheduleDiff(added=[s for s in new if s not in old_set], removed=[s for s in old if s not in new_set])
+    
+    def is_empty(self) -> bool:
+        return len(self.added) == 0 and len(self.removed) == 0
+
+class ScheduleCacheDatabase:
+    DATABASE_NAME = "Schedules"
+    MIGRATIONS = [
+        f"""CREATE TABLE IF NOT EXISTS {DATABASE_NAME} (
+            group_id TEXT NOT NULL,
+            subgroup INTEGER NOT NULL,
+            date_from TEXT NOT NULL,
+            date_to TEXT NOT NULL,
+            fetched_at TIMESTAMP NOT NULL,
+            content_hash TEXT NOT NULL,
+            subjects TEXT NOT NULL,
+            PRIMARY KEY (group_id, subgroup, date_from, date_to)
+        );""",
+        # Validators for conditional requests. Some unversioned caches already have these columns, so the table
+        # is recreated rather than altered; the dropped schedules are fetched again.
+        f"""DROP TABLE {DATABASE_NAME};
+        CREATE TABLE {DATABASE_NAME} (
+            group_id TEXT NOT NULL,
+            subgroup INTEGER NOT NULL,
+            date_from TEXT NOT NULL,
+            date_to TEXT NOT NULL,
+            fetched_at TIMESTAMP NOT NULL,
+            content_hash TEXT NOT NULL,
+            subjects TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            PRIMARY KEY (group_id, subgroup, date_from, date_to)
+        );""",
+    ]
+    
     def __init__(self):
         self.lock = threading.Lock()
-        self.db = sqlite3.connect(constants.USERS_DATABASE_PATH)
+        self.db = sqlite3.connect(constants.SCHEDULES_DATABASE_PATH, check_same_thread=False, timeout=BUSY_TIMEOUT)
+        configure_connection(self.db)
+        migrate(self.db, "schedules", ScheduleCacheDatabase.MIGRATIONS)
         self.cur = self.db.cursor()
         
-        self.cur.execute("""CREATE TABLE IF NOT EXISTS Users (
+    def subject_to_row(subject: parse.ScheduleSubject) -> list:
+        return [int(subject.time_start.timestamp()), int(subject.time_end.timestamp()), subject.mod, subject.name, subject.type, subject.teacher, subject.room]
+    
+    def row_to_subject(row: list) -> parse.ScheduleSubject:
+        return parse.ScheduleSubject(time_start=datetime.fromtimestamp(row[0], tz=utils.DEFAULT_TIMEZONE), time_end=datetime.fromtimestamp(row[1], tz=utils.DEFAULT_TIMEZONE),
+                                     mod=row[2], name=row[3], type=row[4], teacher=row[5], room=row[6])
+        
+    def row_to_schedule(row: tuple) -> tuple[models.UserGroup, CachedSchedule]:
+        group = models.UserGroup(id=row[0], subgroup=row[1] or None)
+        return group, CachedSchedule(index=GroupSchedule(json.loads(row[6])),
+                                     date_from=date.fromisoformat(row[2]) if row[2] else None,
+                                     date_to=date.fromisoformat(row[3]) if row[3] else None,
+                                     fetched_at=datetime.fromtimestamp(row[4], tz=utils.DEFAULT_TIMEZONE),
+                                     content_hash=row[5],
+                                     etag=row[7],
+                                     last_modified=row[8])
+        
+    def save(self, group: models.UserGroup, schedule: CachedSchedule):
+        subjects = json.dumps(schedule.index.rows(), ensure_ascii=False, separators=(',', ':'))
+        
+        with self.lock:
+            # Only the latest fetched window of a group is kept
+            self.cur.execute(f"DELETE FROM {ScheduleCacheDatabase.DATABASE_NAME} WHERE group_id = ? AND subgroup = ?", (group.id, group.subgroup or 0))
+            self.cur.execute(f"INSERT INTO {ScheduleCacheDatabase.DATABASE_NAME} (group_id, subgroup, date_from, date_to, fetched_at, content_hash, subjects, etag, last_modified) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (group.id, group.subgroup or 0,
+                              schedule.date_from.isoformat() if schedule.date_from else '',
+                              schedule.date_to.isoformat() if schedule.date_to else '',
+                              int(schedule.fetched_at.timestamp()), schedule.content_hash, subjects,
+                              schedule.etag, schedule.last_modified))
+            self.db.commit()
+            
+    def touch(self, group: models.UserGroup, schedule: CachedSchedule):
+        with self.lock:
+            self.cur.execute(f"UPDATE {ScheduleCacheDatabase.DATABASE_NAME} SET fetched_at = ?, etag = ?, last_modified = ? WHERE group_id = ? AND subgroup = ?",
+                             (int(schedule.fetched_at.timestamp()), schedule.etag, schedule.last_modified, group.id, group.subgroup or 0))
+            self.db.commit()
+            
+    def get(self, group: models.UserGroup, date_from: date) -> CachedSchedule | None:
+        with self.lock:
+            self.cur.execute(f"SELECT * FROM {ScheduleCacheDatabase.DATABASE_NAME} WHERE group_id = ? AND subgroup = ? AND date_from = ? AND date_to = ''",
+                             (group.id, group.subgroup or 0, date_from.isoformat()))
+            row = self.cur.fetchone()
+        return ScheduleCacheDatabase.row_to_schedule(row)[1] if row is not None else None
+        
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+def schedule_window(day: date | None) -> date:
+    """Every request within a week asks for the schedule from its Monday, so they share one cache entry."""
+    day = day if day is not None else utils.tz_now().date()
+    return day - timedelta(days=day.weekday())
+
+ScheduleKey = tuple[models.UserGroup, date]
+
+@dataclass
+class ScheduleCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+class ScheduleCache:
+    """In-memory LRU of schedules bounded by the number of entries and their size, entries expire after `ttl`."""
+    
+    def __init__(self, max_entries: int, max_bytes: int, ttl: timedelta):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries: OrderedDict[ScheduleKey, tuple[CachedSchedule, int, float]] = OrderedDict()
+        self.stats = ScheduleCacheStats()
+        
+    def get(self, key: ScheduleKey) -> CachedSchedule | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        
+        schedule, _, expires_at = entry
+        if time.monotonic() >= expires_at:
+            self.remove(key)
+            self.stats.expirations += 1
+            self.stats.misses += 1
+            return None
+        
+        self.entries.move_to_end(key)
+        self.stats.hits += 1
+        return schedule
+    
+    def peek(self, key: ScheduleKey) -> CachedSchedule | None:
+        entry = self.entries.get(key)
+        return entry[0] if entry is not None else None
+    
+    def put(self, key: ScheduleKey, schedule: CachedSchedule):
+        self.remove(key)
+        
+        size = schedule.index.size()
+        self.entries[key] = (schedule, size, time.monotonic() + self.ttl.total_seconds())
+        self.stats.bytes += size
+        
+        while len(self.entries) > 1 and (len(self.entries) > self.max_entries or self.stats.bytes > self.max_bytes):
+            self.remove(next(iter(self.entries)))
+            self.stats.evictions += 1
+        self.stats.entries = len(self.entries)
+            
+    def remove(self, key: ScheduleKey):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.stats.bytes -= entry[1]
+        self.stats.entries = len(self.entries)
+        
+    def groups(self) -> list[models.UserGroup]:
+        return list(dict.fromkeys(group for group, _ in self.entries))
+
+class SchedulesDatabase:
+    def __init__(self, cache_database: ScheduleCacheDatabase, parser_pool: parse.ParserPool, cache: ScheduleCache):
+        self.cache_database = cache_database
+        self.cache_thread = DatabaseThread("schedules-db")
+        self.parser_pool = parser_pool
+        # Only recently used schedules are kept in memory, the rest are read back from the disk cache
+        self.cache = cache
+        self.loading: dict[ScheduleKey, asyncio.Task] = {}
+        
+    async def load_subjects(self, group: models.UserGroup, window: date, max_age: timedelta | None, keep: bool) -> GroupSchedule | None:
+        """Returns the schedule of the week window from the disk cache if it is younger than `max_age`, otherwise revalidates it.
+        
+        Schedules loaded only to refresh the disk cache are not kept in memory unless `keep` is set.
+        """
+        key = (group, window)
+        fetched_at = utils.tz_now()
+        
+        in_memory = self.cache.peek(key)
+        keep = keep or in_memory is not None
+        
+        cached = in_memory if in_memory is not None else await self.cache_thread.run(self.cache_database.get, group, window)
+        if cached is not None and max_age is not None and fetched_at - cached.fetched_at < max_age:
+            if keep and in_memory is None:
+                self.cache.put(key, cached)
+            return cached.index
+        
+        page = await parse.fetch_schedule_page(group.id, window, None,
+                                               etag=cached.etag if cached is not None else None,
+                                               last_modified=cached.last_modified if cached is not None else None)
+        if page is None:
+            # A stale copy is better than nothing for the users waiting on it
+            if cached is not None and keep:
+                self.cache.put(key, cached)
+            return None
+        
+        content_hash = hashlib.sha256(page.content).hexdigest() if page.content is not None else None
+        
+        if cached is not None and (page.content is None or content_hash == cached.content_hash):
+            schedule = dataclasses.replace(cached, fetched_at=fetched_at, etag=page.etag, last_modified=page.last_modified)
+            if keep:
+                self.cache.put(key, schedule)
+            await self.cache_thread.run(self.cache_database.touch, group, schedule)
+            return schedule.index
+        
+        if page.content is None:
+            return None
+        
+        parsed = await self.parser_pool.parse_schedule_page(page.content, group.subgroup)
+        if parsed is None:
+            return None
+        
+        subjects = sorted(parsed, key=lambda x: x.time_end)
+        index = GroupSchedule.from_subjects(subjects)
+        
+        if cached is not None:
+            diff = ScheduleDiff.between(cached.subjects, subjects)
+            if not diff.is_empty():
+                logger.info(f"Schedule of group '{group.id}/{group.subgroup}' changed: {len(diff.added)} classes added, {len(diff.removed)} removed")
+        
+        schedule = CachedSchedule(index=index, date_from=window, date_to=None, fetched_at=fetched_at,
+                                  content_hash=content_hash, etag=page.etag, last_modified=page.last_modified)
+        # Readers either see the old or the new schedule, never a partial one
+        if keep:
+            self.cache.put(key, schedule)
+        await self.cache_thread.run(self.cache_database.save, group, schedule)
+        return index
+        
+    async def prefetch_subjects(self, groups: list[models.UserGroup], concurrency: int, max_age: timedelta | None = None, deadline: datetime | None = None):
+        """Fetches schedules of the given groups in order into the disk cache, stale copies are served until replaced."""
+        window = schedule_window(None)
+        
+        logger.info(f"Prefetching {len(groups)} schedules...")
+        
+        semaphore = asyncio.Semaphore(concurrency)
+        done = 0
+        failed: list[models.UserGroup] = []
+        skipped = 0
+        
+        async def prefetch(group: models.UserGroup):
+            nonlocal done, skipped
+            async with semaphore:
+                if deadline is not None and utils.tz_now() >= deadline:
+                    skipped += 1
+                    return
+                
+                try:
+                    schedule = await self.start_loading(group, window, max_age, keep=False)
+                except Exception as e:
+                    logger.error(f"Failed to prefetch schedule of group '{group.id}': {e}")
+                    schedule = None
+                    
+                if schedule is None:
+                    failed.append(group)
+                    
+                done += 1
+                if done % 50 == 0:
+                    logger.info(f"Prefetched {done}/{len(groups)} schedules")
+        
+        await asyncio.gather(*map(prefetch, groups))
+        
+        logger.info(f"Prefetched {done - len(failed)}/{len(groups)} schedules, {len(failed)} failed, {skipped} skipped after the window ended")
+        if len(failed) > 0:
+            logger.warning(f"Failed to prefetch groups: {', '.join(f'{g.id}/{g.subgroup}' for g in failed)}")
+            
+    async def close(self):
+        stats = self.cache.stats
+        logger.info(f"Schedule cache: {stats.hits} hits, {stats.misses} misses, {stats.evictions} evictions, {stats.expirations} expirations, "
+                    f"{stats.entries} entries of {stats.bytes / 2 ** 20:.1f} MiB")
+        await self.cache_thread.run(self.cache_database.close)
+        self.cache_thread.close()
+            
+    def prefetch_subjects_later(self, group: models.UserGroup, window: date | None = None):
+        self.start_loading(group, window if window is not None else schedule_window(None), self.cache.ttl, keep=True)
+            
+    def start_loading(self, group: models.UserGroup, window: date, max_age: timedelta | None, keep: bool) -> asyncio.Task:
+        # Concurrent requests for the same schedule share one fetch
+        key = (group, window)
+        task = self.loading.get(key)
+        if task is None:
+            task = asyncio.create_task(self.load_subjects(group, window, max_age, keep))
+            task.add_done_callback(lambda _: self.loading.pop(key, None))
+            self.loading[key] = task
+        return task
+        
+    async def get_schedule(self, group: models.UserGroup, date_from: date | None = None) -> GroupSchedule | None:
+        window = schedule_window(date_from)
+        key = (group, window)
+        schedule = self.cache.get(key)
+        if schedule is not None:
+            return schedule.index
+        
+        # A copy from the disk cache is served right away, a stale one is revalidated in the background
+        cached = await self.cache_thread.run(self.cache_database.get, group, window)
+        # A fetch that finished in the meantime must not be replaced by the older copy
+        in_memory = self.cache.peek(key)
+        if in_memory is not None:
+            return in_memory.index
+        if cached is not None:
+            if utils.tz_now() - cached.fetched_at >= self.cache.ttl:
+                self.prefetch_subjects_later(group, window)
+            self.cache.put(key, cached)
+            return cached.index
+        
+        # Only a schedule that was never fetched is waited for. A cancelled caller must not cancel the fetch for the others
+        index = await asyncio.shield(self.start_loading(group, window, self.cache.ttl, keep=True))
+        if index is None:
+            schedule = self.cache.peek(key)
+            return schedule.index if schedule is not None else None
+        return index
+
+class UsersDatabase:
+    MIGRATIONS = [
+        """CREATE TABLE IF NOT EXISTS Users (
             id INTEGER NOT NULL PRIMARY KEY,
             group_name TEXT NOT NULL,
             group_id INTEGER NOT NULL,
@@ -66,15 +533,23 @@ class UsersDatabase:
             reminder1 TIMESTAMP NOT NULL,
             reminder2 TIMESTAMP,
             reminder3 TIMESTAMP
-        )""")
-        
-        self.db.commit()
+        );""",
+        "CREATE INDEX IF NOT EXISTS UsersByGroup ON Users (group_id, subgroup);",
+    ]
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(constants.USERS_DATABASE_PATH, check_same_thread=False, timeout=BUSY_TIMEOUT)
+        configure_connection(self.db)
+        migrate(self.db, "users", UsersDatabase.MIGRATIONS)
+        self.cur = self.db.cursor()
         
     def row_to_user(row: tuple) -> models.User:
         reminder1 = models.UserReminderTime(timedelta(seconds=row[4]))
         reminder2 = models.UserReminderTime(timedelta(seconds=row[5])) if row[5] is not None else None
         reminder3 = models.UserReminderTime(timedelta(seconds=row[6])) if row[6] is not None else None
-        return models.User(id=row[0], group=models.UserGroupWithName(name=row[1], id=row[2], subgroup=row[3]), reminder_times=(reminder1, reminder2, reminder3))
+        # group_id is an INTEGER column, groups are keyed by the id as a string everywhere else
+        return models.User(id=row[0], group=models.UserGroupWithName(name=row[1], id=str(row[2]), subgroup=row[3]), reminder_times=(reminder1, reminder2, reminder3))
         
     def insert_user(self, user: models.User):
         with self.lock:
@@ -101,12 +576,12 @@ class UsersDatabase:
             
         return UsersDatabase.row_to_user(row)
     
-    def user_exists(self, user_id: models.UserId) -> bool:
+    def get_groups_by_popularity(self) -> list[tuple[models.UserGroup, int]]:
         with self.lock:
-            self.cur.execute("SELECT EXISTS(SELECT 1 FROM Users WHERE id = ? LIMIT 1)", (user_id,))
-            exists = self.cur.fetchone()[0]
-            return bool(exists)
-        
+            self.cur.execute("SELECT group_id, subgroup, COUNT(*) AS users FROM Users GROUP BY group_id, subgroup ORDER BY users DESC")
+            rows = self.cur.fetchall()
+        return [(models.UserGroup(id=str(row[0]), subgroup=row[1]), row[2]) for row in rows]
+    
     def close(self):
         with self.lock:
             self.db.commit()
@@ -114,13 +589,9 @@ class UsersDatabase:
 
 class NotesDatabase:
     DATABASE_NAME = "Notes"
-    
-    def __init__(self):
-        self.lock = threading.Lock()
-        self.db = sqlite3.connect(constants.NOTES_DATABASE_PATH)
-        self.cur = self.db.cursor()
-        
-        self.cur.execute(f"""CREATE TABLE IF NOT EXISTS {NotesDatabase.DATABASE_NAME} (
+    OUTBOX_NAME = "ReminderOutbox"
+    MIGRATIONS = [
+        f"""CREATE TABLE IF NOT EXISTS {DATABASE_NAME} (
             id INTEGER PRIMARY KEY NOT NULL,
             user_id INTEGER NOT NULL,
             subject_id TEXT,
@@ -128,24 +599,49 @@ class NotesDatabase:
             due_date TIMESTAMP NOT NULL,
             reminded_times INTEGER NOT NULL DEFAULT 0,
             is_completed BOOLEAN NOT NULL DEFAULT 0
-        )""")
-        
-        self.db.commit()
+        );""",
+        # Per-user listings and deletes, and the scan of incomplete notes done by the reminder scheduler
+        f"""CREATE INDEX IF NOT EXISTS NotesByUser ON {DATABASE_NAME} (user_id, is_completed, due_date);
+        CREATE INDEX IF NOT EXISTS CurrentNotesByDueDate ON {DATABASE_NAME} (due_date) WHERE is_completed = 0;""",
+        # Outbox of reminders, a reminder is sent at most once per (note_id, reminder_index)
+        f"""CREATE TABLE IF NOT EXISTS {OUTBOX_NAME} (
+            note_id INTEGER NOT NULL,
+            reminder_index INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            state INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            claimed_by TEXT,
+            finished_at REAL,
+            PRIMARY KEY (note_id, reminder_index)
+        );
+        CREATE INDEX IF NOT EXISTS DueReminders ON {OUTBOX_NAME} (next_attempt_at) WHERE state < 2;
+        CREATE INDEX IF NOT EXISTS FinishedReminders ON {OUTBOX_NAME} (finished_at) WHERE state >= 2;""",
+        # Keyset pagination of the deadlines list in LISTING_ORDER. A blob sorts after any text, so personal notes come last;
+        # SQLite seeks row value comparisons only on plain columns, hence the generated one.
+        f"""ALTER TABLE {DATABASE_NAME} ADD COLUMN subject_order GENERATED ALWAYS AS (IFNULL(subject_id, x'')) VIRTUAL;
+        CREATE INDEX IF NOT EXISTS NotesByUserListing ON {DATABASE_NAME} (user_id, subject_order, is_completed, due_date, id);""",
+    ]
+    # Notes grouped by subject with personal ones last, current before completed, then by due date
+    LISTING_ORDER = ("subject_order", "is_completed", "due_date", "id")
+    FIELD_COLUMNS = {'text': 'content', 'due_date': 'due_date', 'is_completed': 'is_completed'}
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(constants.NOTES_DATABASE_PATH, check_same_thread=False, timeout=BUSY_TIMEOUT)
+        configure_connection(self.db)
+        migrate(self.db, "notes", NotesDatabase.MIGRATIONS)
+        self.cur = self.db.cursor()
         
     def row_to_note(row) -> models.UserNote:
         return models.UserNote(id=row[0], user_id=row[1], subject_id=row[2], text=row[3], due_date=datetime.fromtimestamp(row[4], tz=utils.DEFAULT_TIMEZONE), reminded_times=row[5], is_completed=row[6])
     
-    def insert_note(self, note: models.UserNote):
+    def insert_note(self, note: models.UserNote) -> int:
         with self.lock:
             self.cur.execute(f"INSERT OR REPLACE INTO {NotesDatabase.DATABASE_NAME} (user_id, subject_id, content, due_date) VALUES (?, ?, ?, ?)",
                              (note.user_id, note.subject_id, note.text, int(note.due_date.timestamp())))
             self.db.commit()
-            
-    def update_note(self, note: models.UserNote):
-        with self.lock:
-            self.cur.execute(f"UPDATE {NotesDatabase.DATABASE_NAME} SET subject_id = ?, content = ?, due_date = ?, reminded_times = ?, is_completed = ? WHERE id = ?",
-                             (note.subject_id, note.text, int(note.due_date.timestamp()), note.reminded_times, note.is_completed, note.id))
-            self.db.commit()
+            return self.cur.lastrowid
             
     def delete_note_by_id(self, note_id: models.UserId):
         with self.lock:
@@ -167,6 +663,16 @@ class NotesDatabase:
         
         return NotesDatabase.row_to_note(row)
 
+    def get_notes_by_ids(self, note_ids: list[int]) -> list[models.UserNote]:
+        notes: list[models.UserNote] = []
+        with self.lock:
+            # Stay well below SQLITE_MAX_VARIABLE_NUMBER
+            for i in range(0, len(note_ids), 500):
+                chunk = note_ids[i:i + 500]
+                self.cur.execute(f"SELECT * FROM {NotesDatabase.DATABASE_NAME} WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+                notes.extend(map(NotesDatabase.row_to_note, self.cur.fetchall()))
+        return notes
+
     def get_notes_by_user_id(self, user_id: models.UserId) -> tuple[int, Iterable[models.UserNote]]:
         with self.lock:
             self.cur.execute(f"SELECT * FROM {NotesDatabase.DATABASE_NAME} WHERE user_id = ?", (user_id,))
@@ -175,13 +681,32 @@ class NotesDatabase:
         
     def get_current_notes_by_user_id(self, user_id: models.UserId):
         with self.lock:
-            self.cur.execute(f"SELECT * FROM {NotesDatabase.DATABASE_NAME} WHERE user_id = ? AND is_completed IS FALSE", (user_id,))
+            self.cur.execute(f"SELECT * FROM {NotesDatabase.DATABASE_NAME} WHERE user_id = ? AND is_completed = 0 ORDER BY due_date", (user_id,))
             rows = self.cur.fetchall() 
         return len(rows), map(NotesDatabase.row_to_note, rows)
         
+    def get_notes_page(self, user_id: models.UserId, cursor: int | None, forward: bool, completed: bool, limit: int) -> list[models.UserNote]:
+        """Returns up to `limit` notes of the user that come after (or before) the note `cursor` in listing order."""
+        key = ', '.join(NotesDatabase.LISTING_ORDER)
+        conditions, params = ["user_id = ?"], [user_id]
+        if not completed:
+            # Unary plus keeps the filter off the index so that it is still walked in listing order
+            conditions.append("+is_completed = 0")
+        if cursor is not None:
+            conditions.append(f"({key}) {'>' if forward else '<'} (SELECT {key} FROM {NotesDatabase.DATABASE_NAME} WHERE id = ?)")
+            params.append(cursor)
+        order = ', '.join(column if forward else f"{column} DESC" for column in NotesDatabase.LISTING_ORDER)
+        
+        with self.lock:
+            self.cur.execute(f"SELECT * FROM {NotesDatabase.DATABASE_NAME} WHERE {' AND '.join(conditions)} ORDER BY {order} LIMIT ?", (*params, limit))
+            rows = self.cur.fetchall()
+        
+        notes = list(map(NotesDatabase.row_to_note, rows))
+        return notes if forward else notes[::-1]
+        
     def get_current_notes(self):
         with self.lock:
-            self.cur.execute(f"SELECT * FROM {NotesDatabase.DATABASE_NAME} WHERE is_completed IS FALSE")
+            self.cur.execute(f"SELECT * FROM {NotesDatabase.DATABASE_NAME} WHERE is_completed = 0 ORDER BY due_date")
             rows = self.cur.fetchall() 
         return len(rows), map(NotesDatabase.row_to_note, rows)
             
@@ -190,6 +715,76 @@ class NotesDatabase:
             self.cur.execute(f"UPDATE {NotesDatabase.DATABASE_NAME} SET is_completed = ? WHERE id = ?", (is_completed, note_id))
             self.db.commit()
     
+    def update_notes_state(self, notes: Iterable[models.UserNote]):
+        """Writes reminded_times and is_completed of every given note in one transaction."""
+        with self.lock, self.db:
+            self.cur.executemany(f"UPDATE {NotesDatabase.DATABASE_NAME} SET reminded_times = ?, is_completed = ? WHERE id = ?",
+                                 ((note.reminded_times, note.is_completed, note.id) for note in notes))
+    
+    def complete_expired_notes(self, now: datetime) -> int:
+        with self.lock, self.db:
+            self.cur.execute(f"UPDATE {NotesDatabase.DATABASE_NAME} SET is_completed = 1 WHERE is_completed = 0 AND due_date <= ?", (int(now.timestamp()),))
+            return self.cur.rowcount
+    
+    def apply_changes(self, changes: dict[int, dict[str, Any]], deleted: Iterable[int]):
+        """Writes buffered field changes and deletions of many notes in one transaction."""
+        with self.lock, self.db:
+            for note_id, fields in changes.items():
+                columns = [NotesDatabase.FIELD_COLUMNS[name] for name in fields]
+                values = [int(value.timestamp()) if isinstance(value, datetime) else value for value in fields.values()]
+                self.cur.execute(f"UPDATE {NotesDatabase.DATABASE_NAME} SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ?", (*values, note_id))
+            self.cur.executemany(f"DELETE FROM {NotesDatabase.DATABASE_NAME} WHERE id = ?", ((note_id,) for note_id in deleted))
+    
+    def enqueue_reminders(self, reminders: Iterable[tuple[int, int, models.UserId]], now: float):
+        """Adds (note id, reminder index, user id) reminders to the outbox, reminders that are already there are left as they are.
+
+        Dropped reminders are queued again, their note was changed while they were in flight and is due again.
+        """
+        with self.lock, self.db:
+            self.cur.executemany(f"INSERT INTO {NotesDatabase.OUTBOX_NAME} (note_id, reminder_index, user_id, next_attempt_at) VALUES (?, ?, ?, ?) "
+                                 f"ON CONFLICT (note_id, reminder_index) DO UPDATE SET state = ?, attempts = 0, next_attempt_at = excluded.next_attempt_at, "
+                                 f"user_id = excluded.user_id, claimed_by = NULL, finished_at = NULL WHERE state = ?",
+                                 ((note_id, index, user_id, now, models.ReminderState.PENDING, models.ReminderState.DROPPED) for note_id, index, user_id in reminders))
+    
+    def claim_reminders(self, worker_id: str, now: float, claim_ttl: float, limit: int, owns: Callable[[models.UserId], bool] | None = None,
+                        skip: frozenset[int] = frozenset()) -> list[models.QueuedReminder]:
+        """Claims due reminders for `claim_ttl` seconds, reminders whose claim ran out are due again. Reminders of notes in `skip` are left for later."""
+        with self.lock, self.db:
+            self.db.create_function('owns_user', 1, owns if owns is not None else lambda user_id: True)
+            self.db.create_function('skipped_note', 1, skip.__contains__)
+            self.cur.execute(f"UPDATE {NotesDatabase.OUTBOX_NAME} SET state = ?, claimed_by = ?, next_attempt_at = ?, attempts = attempts + 1 "
+                             f"WHERE rowid IN (SELECT rowid FROM {NotesDatabase.OUTBOX_NAME} WHERE state < 2 AND next_attempt_at <= ? AND owns_user(user_id) AND NOT skipped_note(note_id) "
+                             f"ORDER BY next_attempt_at LIMIT ?) RETURNING note_id, reminder_index, user_id, attempts",
+                             (models.ReminderState.CLAIMED, worker_id, now + claim_ttl, now, limit))
+            return [models.QueuedReminder(*row) for row in self.cur.fetchall()]
+    
+    def retry_reminders(self, reminders: Iterable[tuple[int, int, float]]):
+        """Returns claimed (note id, reminder index) reminders to the outbox until the given time."""
+        with self.lock, self.db:
+            self.cur.executemany(f"UPDATE {NotesDatabase.OUTBOX_NAME} SET state = ?, claimed_by = NULL, next_attempt_at = ? WHERE note_id = ? AND reminder_index = ? AND state = ?",
+                                 ((models.ReminderState.PENDING, retry_at, note_id, index, models.ReminderState.CLAIMED) for note_id, index, retry_at in reminders))
+    
+    def release_reminders(self, worker_id: str, now: float) -> int:
+        """Makes reminders claimed by an earlier run of the worker due right away."""
+        with self.lock, self.db:
+            self.cur.execute(f"UPDATE {NotesDatabase.OUTBOX_NAME} SET state = ?, claimed_by = NULL, next_attempt_at = ? WHERE state = ? AND claimed_by = ?",
+                             (models.ReminderState.PENDING, now, models.ReminderState.CLAIMED, worker_id))
+            return self.cur.rowcount
+    
+    def finish_reminders(self, reminders: Iterable[tuple[int, int, models.ReminderState]], now: float):
+        """Records the outcome of (note id, reminder index) reminders in the same transaction as the progress of their notes."""
+        reminders = list(reminders)
+        with self.lock, self.db:
+            self.cur.executemany(f"UPDATE {NotesDatabase.OUTBOX_NAME} SET state = ?, finished_at = ? WHERE note_id = ? AND reminder_index = ? AND state < 2",
+                                 ((state, now, note_id, index) for note_id, index, state in reminders))
+            self.cur.executemany(f"UPDATE {NotesDatabase.DATABASE_NAME} SET reminded_times = MAX(reminded_times, ?) WHERE id = ?",
+                                 ((index + 1, note_id) for note_id, index, state in reminders if state != models.ReminderState.DROPPED))
+    
+    def purge_reminders(self, before: float) -> int:
+        with self.lock, self.db:
+            self.cur.execute(f"DELETE FROM {NotesDatabase.OUTBOX_NAME} WHERE state >= 2 AND finished_at < ?", (before,))
+            return self.cur.rowcount
+    
     def update_note_text(self, note_id: int, new_text: str):
         with self.lock:
             self.cur.execute(f"UPDATE {NotesDatabase.DATABASE_NAME} SET content = ? WHERE id = ?", (new_text, note_id))
@@ -204,3 +799,231 @@ class NotesDatabase:
         with self.lock:
             self.db.commit()
             self.db.close()
+
+@dataclass
+class UserCacheStats:
+    hits: int = 0
+    misses: int = 0
+    
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+class AsyncUsersDatabase:
+    """Awaitable front of UsersDatabase, every query runs on the database thread.
+    
+    Profiles, and the absence of one, are kept in a bounded TTL cache that writes invalidate.
+    """
+    
+    def __init__(self, database: UsersDatabase, cache_size: int = 10000, cache_ttl: timedelta = timedelta(minutes=10)):
+        self.database = database
+        self.thread = DatabaseThread("users-db")
+        self.cache: cachetools.TTLCache[models.UserId, models.User | None] = cachetools.TTLCache(maxsize=cache_size, ttl=cache_ttl.total_seconds())
+        # Bumped by every write so that a read started before it does not cache a stale profile
+        self.cache_version = 0
+        self.stats = UserCacheStats()
+        
+    def invalidate(self, id: models.UserId):
+        self.cache_version += 1
+        self.cache.pop(id, None)
+        
+    def invalidate_where(self, predicate: Callable[[models.UserId], bool]):
+        self.cache_version += 1
+        for id in [id for id in self.cache if predicate(id)]:
+            self.cache.pop(id, None)
+        
+    async def insert_user(self, user: models.User):
+        self.invalidate(user.id)
+        await self.thread.run(self.database.insert_user, user)
+        self.invalidate(user.id)
+        
+    async def delete_by_id(self, id: models.UserId):
+        self.invalidate(id)
+        await self.thread.run(self.database.delete_by_id, id)
+        self.invalidate(id)
+        
+    async def get_user_by_id(self, id: models.UserId) -> Optional[models.User]:
+        try:
+            user = self.cache[id]
+            self.stats.hits += 1
+        except KeyError:
+            self.stats.misses += 1
+            version = self.cache_version
+            user = await self.thread.run(self.database.get_user_by_id, id)
+            if version == self.cache_version:
+                self.cache[id] = user
+        
+        # Handlers modify the profile they get before saving it
+        return dataclasses.replace(user) if user is not None else None
+    
+    async def get_groups_by_popularity(self) -> list[tuple[models.UserGroup, int]]:
+        return await self.thread.run(self.database.get_groups_by_popularity)
+    
+    async def close(self):
+        logger.info(f"User cache: {self.stats.hits} hits, {self.stats.misses} misses ({self.stats.hit_rate:.0%})")
+        await self.thread.run(self.database.close)
+        self.thread.close()
+
+class AsyncNotesDatabase:
+    """Awaitable front of NotesDatabase, every query runs on the database thread.
+    
+    In write-behind mode note edits and deletions are kept in memory and group-committed
+    every `flush_interval` or `flush_ops` operations, whichever comes first.
+    """
+    
+    def __init__(self, database: NotesDatabase, write_behind: bool = False, flush_interval: timedelta = timedelta(milliseconds=200), flush_ops: int = 100):
+        self.database = database
+        self.thread = DatabaseThread("notes-db")
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.flush_ops = flush_ops
+        # Not yet committed changes, note id -> changed UserNote fields
+        self.changes: dict[int, dict[str, Any]] = {}
+        self.deleted: set[int] = set()
+        # Changes handed to the database thread, reads that were queued before them must still see them
+        self.flushing_changes: dict[int, dict[str, Any]] = {}
+        self.flushing_deleted: set[int] = set()
+        self.pending_ops = 0
+        self.flush_lock = asyncio.Lock()
+        self.flush_task: asyncio.Task | None = None
+        # Flush started early because `flush_ops` were buffered
+        self.ops_flush_task: asyncio.Task | None = None
+        
+    def start(self):
+        if self.write_behind:
+            self.flush_task = asyncio.create_task(self.flush_periodically())
+    
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval.total_seconds())
+            await self.flush()
+    
+    async def flush(self):
+        async with self.flush_lock:
+            if self.pending_ops == 0:
+                return
+            
+            changes, deleted, pending_ops = self.changes, self.deleted, self.pending_ops
+            self.changes, self.deleted, self.pending_ops = {}, set(), 0
+            self.flushing_changes, self.flushing_deleted = changes, deleted
+            try:
+                await self.thread.run(self.database.apply_changes, changes, deleted)
+            except Exception as e:
+                logger.exception(f"Failed to flush {pending_ops} note changes: {e}")
+                # Keep them for the next flush, newer changes win
+                for note_id, fields in changes.items():
+                    if note_id not in self.deleted:
+                        self.changes[note_id] = fields | self.changes.get(note_id, {})
+                self.deleted |= deleted
+                self.pending_ops += pending_ops
+            finally:
+                self.flushing_changes, self.flushing_deleted = {}, set()
+    
+    def buffer(self, note_id: int, **fields):
+        if note_id in self.deleted or note_id in self.flushing_deleted:
+            return
+        self.changes.setdefault(note_id, {}).update(fields)
+        self.count_op()
+    
+    def count_op(self):
+        self.pending_ops += 1
+        if self.pending_ops >= self.flush_ops and (self.ops_flush_task is None or self.ops_flush_task.done()):
+            self.ops_flush_task = asyncio.create_task(self.flush())
+    
+    def apply_buffered(self, note: models.UserNote | None) -> models.UserNote | None:
+        if note is None or note.id in self.deleted or note.id in self.flushing_deleted:
+            return None
+        fields = self.flushing_changes.get(note.id, {}) | self.changes.get(note.id, {})
+        return dataclasses.replace(note, **fields) if fields else note
+        
+    async def insert_note(self, note: models.UserNote) -> int:
+        return await self.thread.run(self.database.insert_note, note)
+    
+    async def delete_note_by_id(self, note_id: int):
+        if not self.write_behind:
+            await self.thread.run(self.database.delete_note_by_id, note_id)
+            return
+        self.changes.pop(note_id, None)
+        self.deleted.add(note_id)
+        self.count_op()
+        
+    async def delete_all_by_user_id(self, user_id: models.UserId):
+        await self.flush()
+        await self.thread.run(self.database.delete_all_by_user_id, user_id)
+        
+    async def get_note_by_id(self, note_id: int) -> Optional[models.UserNote]:
+        return self.apply_buffered(await self.thread.run(self.database.get_note_by_id, note_id))
+    
+    async def get_notes_by_ids(self, note_ids: list[int]) -> list[models.UserNote]:
+        notes = await self.thread.run(self.database.get_notes_by_ids, note_ids)
+        return [note for note in map(self.apply_buffered, notes) if note is not None]
+    
+    async def get_current_notes_by_user_id(self, user_id: models.UserId) -> tuple[int, Iterable[models.UserNote]]:
+        await self.flush()
+        return await self.thread.run(self.database.get_current_notes_by_user_id, user_id)
+    
+    async def get_notes_page(self, user_id: models.UserId, cursor: int | None, forward: bool, completed: bool, limit: int) -> list[models.UserNote]:
+        await self.flush()
+        return await self.thread.run(self.database.get_notes_page, user_id, cursor, forward, completed, limit)
+    
+    async def get_current_notes(self) -> tuple[int, Iterable[models.UserNote]]:
+        await self.flush()
+        return await self.thread.run(self.database.get_current_notes)
+    
+    async def update_note_completed(self, note_id: int, is_completed: bool):
+        if self.write_behind:
+            self.buffer(note_id, is_completed=is_completed)
+        else:
+            await self.thread.run(self.database.update_note_completed, note_id, is_completed)
+        
+    async def update_notes_state(self, notes: Iterable[models.UserNote]):
+        await self.flush()
+        await self.thread.run(self.database.update_notes_state, list(notes))
+    
+    async def complete_expired_notes(self, now: datetime) -> int:
+        await self.flush()
+        return await self.thread.run(self.database.complete_expired_notes, now)
+    
+    async def enqueue_reminders(self, reminders: Iterable[tuple[int, int, models.UserId]]):
+        await self.thread.run(self.database.enqueue_reminders, list(reminders), time.time())
+    
+    async def claim_reminders(self, worker_id: str, claim_ttl: timedelta, limit: int, owns: Callable[[models.UserId], bool] | None = None,
+                              skip: Iterable[int] = ()) -> list[models.QueuedReminder]:
+        return await self.thread.run(self.database.claim_reminders, worker_id, time.time(), claim_ttl.total_seconds(), limit, owns, frozenset(skip))
+    
+    async def retry_reminders(self, reminders: Iterable[tuple[int, int, float]]):
+        await self.thread.run(self.database.retry_reminders, list(reminders))
+    
+    async def release_reminders(self, worker_id: str) -> int:
+        return await self.thread.run(self.database.release_reminders, worker_id, time.time())
+    
+    async def finish_reminders(self, reminders: Iterable[tuple[int, int, models.ReminderState]]):
+        # The progress of a note is committed after the changes made to it before
+        await self.flush()
+        await self.thread.run(self.database.finish_reminders, list(reminders), time.time())
+    
+    async def purge_reminders(self, before: float) -> int:
+        return await self.thread.run(self.database.purge_reminders, before)
+    
+    async def update_note_text(self, note_id: int, new_text: str):
+        if self.write_behind:
+            self.buffer(note_id, text=new_text)
+        else:
+            await self.thread.run(self.database.update_note_text, note_id, new_text)
+        
+    async def update_note_due_date(self, note_id: int, new_due_date: datetime):
+        if self.write_behind:
+            self.buffer(note_id, due_date=new_due_date)
+        else:
+            await self.thread.run(self.database.update_note_due_date, note_id, new_due_date)
+        
+    async def close(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            await asyncio.gather(self.flush_task, return_exceptions=True)
+        if self.ops_flush_task is not None:
+            await self.ops_flush_task
+        await self.flush()
+        await self.thread.run(self.database.close)
+        self.thread.close()
@@ -0,0 +1,13 @@
+from datetime import date
+
+# Same abbreviations as strftime's %b and %a under glibc's ru_RU.UTF-8, months in the genitive case
+MONTHS = ("янв", "фев", "мар", "апр", "мая", "июн", "июл", "авг", "сен", "окт", "ноя", "дек")
+WEEKDAYS = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
+
+def day_month_year(d: date) -> str:
+    """Same as `d.strftime("%d %b %Y")` in the Russian locale, e.g. "05 мая 2026"."""
+    return f"{d.day:02} {MONTHS[d.month - 1]} {d.year}"
+
+def weekday_day_month(d: date) -> str:
+    """Same as `d.strftime("%a, %d %b")` in the Russian locale, e.g. "Вт, 05 мая"."""
+    return f"{WEEKDAYS[d.weekday()]}, {d.day:02} {MONTHS[d.month - 1]}"
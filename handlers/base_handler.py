@@ -7,18 +7,22 @@ from itertools import groupby
 import constants
 import keyboards
 import database
+import models
 import utils
+import dateformat
+import reminders
 from states import MainState, NoteEditState, DeleteUserDataState
-from callbacks import NumCallback, NotificationCompleteCallback, NoteEditCallback
-from handlers.utils import check_user_exists
+from callbacks import NumCallback, NotificationCompleteCallback, NoteEditCallback, NotesPageCallback
 
 MENU_MY_DEADLINES_ID = 1
 MENU_SETTINGS_ID = 2
 
-async def handle_start(message: types.Message, users_database: database.UsersDatabase, state: FSMContext):
+DEADLINES_PAGE_SIZE = 10
+
+async def handle_start(message: types.Message, user: models.User | None, state: FSMContext):
     await state.clear()
     
-    if users_database.user_exists(message.from_user.id):
+    if user is not None:
         await state.set_state(DeleteUserDataState.Confirmation)
         
         keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
@@ -35,9 +39,10 @@ async def handle_start(message: types.Message, users_database: database.UsersDat
                         reply_markup=keyboards.START_KEYBOARD)
 
 
-async def handle_confirm_delete_info(call: types.CallbackQuery, state: FSMContext, users_database: database.UsersDatabase, notes_database: database.NotesDatabase):
-    users_database.delete_by_id(call.from_user.id)
-    notes_database.delete_all_by_user_id(call.from_user.id)
+async def handle_confirm_delete_info(call: types.CallbackQuery, state: FSMContext, users_database: database.AsyncUsersDatabase, notes_database: database.AsyncNotesDatabase, reminder_scheduler: reminders.ReminderScheduler):
+    await users_database.delete_by_id(call.from_user.id)
+    await notes_database.delete_all_by_user_id(call.from_user.id)
+    reminder_scheduler.remove_user(call.from_user.id)
     
     await call.message.edit_text("<b>Информация о вас успешна удалена!</b>\n\nЧтобы продолжать пользоваться ботом, вам нужно снова пройти регистрацию с помощью /start.")
     
@@ -50,10 +55,7 @@ async def handle_cancel(call: types.CallbackQuery, state: FSMContext):
     await call.message.edit_text("Отменено")
 
 
-async def handle_menu(message: types.Message, state: FSMContext, users_database: database.UsersDatabase):
-    if not await check_user_exists(message, users_database=users_database):
-        return
-    
+async def handle_menu(message: types.Message, state: FSMContext):
     keyboard = InlineKeyboardBuilder()
     keyboard.add(types.InlineKeyboardButton(text="1", callback_data=NumCallback(num=MENU_MY_DEADLINES_ID).pack()))
     keyboard.add(types.InlineKeyboardButton(text="2", callback_data=NumCallback(num=MENU_SETTINGS_ID).pack()))
@@ -67,10 +69,7 @@ async def handle_menu(message: types.Message, state: FSMContext, users_database:
     await state.set_state(MainState.Menu)
     
 
-async def handle_settings(call: types.CallbackQuery, state: FSMContext, users_database: database.UsersDatabase):
-    user = users_database.get_user_by_id(call.from_user.id)
-    assert(user is not None)
-    
+async def handle_settings(call: types.CallbackQuery, state: FSMContext, user: models.User):
     reminder_times_text = utils.user_reminder_times_to_text(user)
     
     builder = InlineKeyboardBuilder()
@@ -94,65 +93,75 @@ async def handle_settings(call: types.CallbackQuery, state: FSMContext, users_da
     await state.set_state(MainState.Settings)
 
 
-async def handle_my_deadlines(call: types.CallbackQuery, state: FSMContext, notes_database: database.NotesDatabase):
-    count, total_notes = notes_database.get_notes_by_user_id(call.from_user.id)
+async def show_deadlines_page(call: types.CallbackQuery, state: FSMContext, notes_database: database.AsyncNotesDatabase, cursor: int | None, forward: bool, completed: bool):
+    # One note more tells whether the list goes on past this page
+    notes = await notes_database.get_notes_page(call.from_user.id, cursor, forward, completed, DEADLINES_PAGE_SIZE + 1)
+    has_more = len(notes) > DEADLINES_PAGE_SIZE
+    if has_more:
+        notes = notes[:DEADLINES_PAGE_SIZE] if forward else notes[1:]
     
-    if count > 0:
-        builder = InlineKeyboardBuilder()
-        
-        total_notes = list(total_notes)
-        
-        subject_notes = filter(lambda n: n.subject_id is not None, total_notes)
-        personal_notes = filter(lambda n: n.subject_id is None, total_notes) 
-        
-        sorted_subject_notes = sorted(subject_notes, key=lambda n: n.subject_id)
-        
-        msg_text = ""
-        i = 1
-        
-        grouped_notes = groupby(sorted_subject_notes, key=lambda n: n.subject_id)
-        for subject, notes in grouped_notes:
-            msg_text += f"<b>{subject}</b>:\n"
-            sorted_notes = sorted(notes, key=lambda n: n.due_date and n.is_completed)
-            with utils.time_locale('ru_RU.UTF-8'):
-                for note in sorted_notes:
-                    date_text: str = note.due_date.strftime("%d %b %Y")
-                    msg_text += f"    {i}) "
-                    if note.is_completed:
-                        msg_text += f"<s>\"{note.text}\" — к {date_text}</s>"
-                    else:
-                        msg_text += f"\"{note.text}\" — к {date_text}"
-                    msg_text += '\n'
-                    builder.add(types.InlineKeyboardButton(text=str(i), callback_data=NoteEditCallback(note_id=note.id).pack()))
-                    i += 1
-            msg_text += "\n"
-            
-        sorted_personal_notes = sorted(personal_notes, key=lambda n: n.due_date and n.is_completed)
-            
-        if len(sorted_personal_notes) > 0:
-            msg_text += "<b>Личные заметки</b>:\n"
-            with utils.time_locale('ru_RU.UTF-8'):
-                for note in sorted_personal_notes:
-                    date_text: str = note.due_date.strftime("%d %b %Y")
-                    msg_text += f"    {i}) "
-                    if note.is_completed:
-                        msg_text += f"<s>\"{note.text}\" — к {date_text}</s>"
-                    else:
-                        msg_text += f"\"{note.text}\" — к {date_text}"
-                    msg_text += '\n'
-                    builder.add(types.InlineKeyboardButton(text=str(i), callback_data=NoteEditCallback(note_id=note.id).pack()))
-                    i += 1
-            
-        builder.row(keyboards.CANCEL_BUTTON)
-            
-        await call.message.edit_text("<b>Ваши дедлайны:</b>\n\n"
-                                     "<i>Для внесения изменений нажмите на кнопку, соответствующей номеру дедлайна.</i>\n\n"
-                                     f"{msg_text}",
-                                     reply_markup=builder.as_markup(resize_keyboard=True))
-        await state.set_state(NoteEditState.Menu)
-    else:
-        await call.message.edit_text("У вас пока нет дедлайнов.")
-        await state.clear()
+    if len(notes) == 0 and cursor is not None:
+        # The notes around the cursor were deleted meanwhile
+        await show_deadlines_page(call, state, notes_database, None, True, completed)
+        return
+    
+    filter_button = types.InlineKeyboardButton(text="Скрыть выполненные" if completed else "Показать выполненные",
+                                               callback_data=NotesPageCallback(cursor=0, forward=True, completed=not completed).pack())
+    
+    if len(notes) == 0:
+        if completed:
+            await call.message.edit_text("У вас пока нет дедлайнов.")
+            await state.clear()
+        else:
+            await call.message.edit_text("У вас нет невыполненных дедлайнов.",
+                                         reply_markup=types.InlineKeyboardMarkup(inline_keyboard=[[filter_button], [keyboards.CANCEL_BUTTON]]))
+            await state.set_state(NoteEditState.Menu)
+        return
+    
+    builder = InlineKeyboardBuilder()
+    parts: list[str] = []
+    number = 1
+    
+    for subject, subject_notes in groupby(notes, key=lambda n: n.subject_id):
+        parts.append(f"<b>{subject if subject is not None else 'Личные заметки'}</b>:\n")
+        for note in subject_notes:
+            date_text: str = dateformat.day_month_year(note.due_date)
+            if note.is_completed:
+                parts.append(f"    {number}) <s>\"{note.text}\" — к {date_text}</s>\n")
+            else:
+                parts.append(f"    {number}) \"{note.text}\" — к {date_text}\n")
+            builder.add(types.InlineKeyboardButton(text=str(number), callback_data=NoteEditCallback(note_id=note.id).pack()))
+            number += 1
+        parts.append("\n")
+    builder.adjust(5)
+    
+    # Going forward there is a previous page whenever the listing started from a note, and the other way round
+    has_next = has_more if forward else cursor is not None
+    has_previous = cursor is not None if forward else has_more
+    navigation = []
+    if has_previous:
+        navigation.append(types.InlineKeyboardButton(text="◀️", callback_data=NotesPageCallback(cursor=notes[0].id, forward=False, completed=completed).pack()))
+    if has_next:
+        navigation.append(types.InlineKeyboardButton(text="▶️", callback_data=NotesPageCallback(cursor=notes[-1].id, forward=True, completed=completed).pack()))
+    if len(navigation) > 0:
+        builder.row(*navigation)
+    builder.row(filter_button)
+    builder.row(keyboards.CANCEL_BUTTON)
+    
+    await call.message.edit_text("<b>Ваши дедлайны:</b>\n\n"
+                                 "<i>Для внесения изменений нажмите на кнопку, соответствующей номеру дедлайна.</i>\n\n"
+                                 f"{''.join(parts)}",
+                                 reply_markup=builder.as_markup(resize_keyboard=True))
+    await state.set_state(NoteEditState.Menu)
+
+
+async def handle_my_deadlines(call: types.CallbackQuery, state: FSMContext, notes_database: database.AsyncNotesDatabase):
+    await show_deadlines_page(call, state, notes_database, None, True, False)
+
+
+async def handle_deadlines_page(call: types.CallbackQuery, callback_data: NotesPageCallback, state: FSMContext, notes_database: database.AsyncNotesDatabase):
+    await call.answer()
+    await show_deadlines_page(call, state, notes_database, callback_data.cursor or None, callback_data.forward, callback_data.completed)
 
 
 async def handle_admins_info(call: types.CallbackQuery, state: FSMContext):
@@ -167,9 +176,11 @@ async def handle_admins_info(call: types.CallbackQuery, state: FSMContext):
 async def handle_notification_complete(
     call: types.CallbackQuery,
     callback_data: NotificationCompleteCallback,
-    notes_database: database.NotesDatabase
+    notes_database: database.AsyncNotesDatabase,
+    reminder_scheduler: reminders.ReminderScheduler
 ):
-    notes_database.update_note_completed(callback_data.note_id, True)
+    await notes_database.update_note_completed(callback_data.note_id, True)
+    reminder_scheduler.remove_note(callback_data.note_id)
     
     await call.answer("Задание помечено как выполненное")
     await call.message.edit_reply_markup(reply_markup=None)
@@ -179,9 +190,10 @@ def register(router: Router):
     router.callback_query.register(handle_confirm_delete_info, StateFilter(DeleteUserDataState.Confirmation), F.data == 'yes')
     
     router.message.register(handle_start, CommandStart())
-    router.message.register(handle_menu, StateFilter(None), Command("menu"))
+    router.message.register(handle_menu, StateFilter(None), Command("menu"), flags={"registered": True})
     
-    router.callback_query.register(handle_settings, StateFilter(MainState.Menu), NumCallback.filter(F.num == MENU_SETTINGS_ID))
+    router.callback_query.register(handle_settings, StateFilter(MainState.Menu), NumCallback.filter(F.num == MENU_SETTINGS_ID), flags={"registered": True})
     router.callback_query.register(handle_my_deadlines, StateFilter(MainState.Menu), NumCallback.filter(F.num == MENU_MY_DEADLINES_ID))
+    router.callback_query.register(handle_deadlines_page, StateFilter(NoteEditState.Menu), NotesPageCallback.filter())
     router.callback_query.register(handle_admins_info, StateFilter(MainState.Settings), NumCallback.filter(F.num == 3))
     router.callback_query.register(handle_notification_complete, StateFilter(None), NotificationCompleteCallback.filter())
\ No newline at end of file
@@ -9,6 +9,7 @@ import utils
 import keyboards
 import models
 import database
+import reminders
 from callbacks import NumCallback
 from states import ConfigureReminderState, MainState
 
@@ -45,7 +46,7 @@ async def handle_ask_time(call: types.CallbackQuery, callback_data: NumCallback,
     await state.set_state(ConfigureReminderState.GetTime)
 
 
-async def handle_get_time(message: types.Message, state: FSMContext, users_database: database.UsersDatabase):
+async def handle_get_time(message: types.Message, state: FSMContext, user: models.User, users_database: database.AsyncUsersDatabase, reminder_scheduler: reminders.ReminderScheduler):
     total = await state.get_value("total")
     current = await state.get_value("current", 1)
         
@@ -85,9 +86,6 @@ async def handle_get_time(message: types.Message, state: FSMContext, users_datab
             await message.answer(f"⏰ Укажите количесто <b>часов</b> от {range_start} до {range_end} включительно, за которое необходимо напоминать в {current}-й раз.",
                                 reply_markup=builder.as_markup())
     else:
-        user = users_database.get_user_by_id(message.from_user.id)
-        assert(user is not None)
-        
         reminder_times = list(user.reminder_times)
     
         for i in range(0, len(values) - 1):
@@ -96,7 +94,8 @@ async def handle_get_time(message: types.Message, state: FSMContext, users_datab
 
         user.reminder_times = tuple(reminder_times)
         
-        users_database.insert_user(user)
+        await users_database.insert_user(user)
+        await reminder_scheduler.update_user(user.id)
         
         await message.answer("✅ <b>Напоминания о дедлайнах успешно обновлены!</b>")
         
@@ -107,4 +106,4 @@ async def handle_get_time(message: types.Message, state: FSMContext, users_datab
 def register(router: Router):
     router.callback_query.register(handle_configure_reminders, StateFilter(MainState.Settings), NumCallback.filter(F.num == 2))
     router.callback_query.register(handle_ask_time, StateFilter(ConfigureReminderState.AskTime), NumCallback.filter())
-    router.message.register(handle_get_time, StateFilter(ConfigureReminderState.GetTime), F.text.isdigit())
\ No newline at end of file
+    router.message.register(handle_get_time, StateFilter(ConfigureReminderState.GetTime), F.text.isdigit(), flags={"registered": True})
\ No newline at end of file
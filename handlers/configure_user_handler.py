@@ -16,7 +16,7 @@ logger = logging.getLogger(__name__)
 async def handle_configure_group(call: types.CallbackQuery, state: FSMContext, groups_database: database.GroupsDatabase):
     logger.info(f"User '{call.from_user.id}' has started updating the group")
     
-    with groups_database.get_groups() as groups:
+    async with groups_database.get_groups() as groups:
         msg_text, keyboard = utils.generate_choice_message(groups)
         
     keyboard.row(keyboards.CANCEL_BUTTON)
@@ -29,7 +29,7 @@ async def handle_ask_faculty(call: types.CallbackQuery, callback_data: NumCallba
     await call.answer()
     await state.update_data(faculty=callback_data.num)
     
-    with groups_database.get_groups() as groups:
+    async with groups_database.get_groups() as groups:
         faculty = groups[callback_data.num]
         msg_text, keyboard = utils.generate_choice_message(faculty.forms)
     
@@ -46,7 +46,7 @@ async def handle_ask_form(call: types.CallbackQuery, callback_data: NumCallback,
     
     faculty: int = await state.get_value("faculty")
     
-    with groups_database.get_groups() as groups:
+    async with groups_database.get_groups() as groups:
         form = groups[faculty].forms[callback_data.num]
         msg_text, keyboard = utils.generate_choice_message(form.stages)
     
@@ -64,7 +64,7 @@ async def handle_ask_stage(call: types.CallbackQuery, callback_data: NumCallback
     faculty: int = await state.get_value("faculty")
     form: int = await state.get_value("form")
     
-    with groups_database.get_groups() as groups:
+    async with groups_database.get_groups() as groups:
         stage = groups[faculty].forms[form].stages[callback_data.num]
         msg_text, keyboard = utils.generate_choice_message(stage.courses)
     
@@ -83,7 +83,7 @@ async def handle_ask_course(call: types.CallbackQuery, callback_data: NumCallbac
     form: int = await state.get_value("form")
     stage: int = await state.get_value("stage")
     
-    with groups_database.get_groups() as groups:
+    async with groups_database.get_groups() as groups:
         course = groups[faculty].forms[form].stages[stage].courses[callback_data.num]
         msg_text, keyboard = utils.generate_choice_message(course.groups)
 
@@ -102,7 +102,7 @@ async def handle_ask_group(call: types.CallbackQuery, callback_data: NumCallback
     stage: int = await state.get_value("stage")
     course: int = await state.get_value("course")
     
-    with groups_database.get_groups() as groups:
+    async with groups_database.get_groups() as groups:
         group = groups[faculty].forms[form].stages[stage].courses[course].groups[callback_data.num]
     
     await state.update_data(group_id=group.id)
@@ -124,21 +124,18 @@ async def handle_ask_group(call: types.CallbackQuery, callback_data: NumCallback
     await state.set_state(ConfigureUserState.SubGroup)
     
 
-async def handle_ask_subgroup(call: types.CallbackQuery, callback_data: NumCallback, state: FSMContext, users_database: database.UsersDatabase):
+async def handle_ask_subgroup(call: types.CallbackQuery, callback_data: NumCallback, state: FSMContext, user: models.User, users_database: database.AsyncUsersDatabase, schedules_database: database.SchedulesDatabase):
     await call.answer()
     
     data = await state.get_data()
     group_id = data['group_id']
     group_name = data['group_name']
     subgroup = callback_data.num if callback_data.num > 0 else None
-    user_id = call.from_user.id
-    
-    user = users_database.get_user_by_id(user_id)
-    assert(user is not None)
     
     user.group = models.UserGroupWithName(group_name, group_id, subgroup)
     
-    users_database.insert_user(user)
+    await users_database.insert_user(user)
+    schedules_database.prefetch_subjects_later(user.group.without_name())
     
     await call.message.edit_text("✅ <b>Группа успешна обновлена!</b>")
     
@@ -154,6 +151,6 @@ def register(router: Router):
     router.callback_query.register(handle_ask_stage, StateFilter(ConfigureUserState.Stage), NumCallback.filter())
     router.callback_query.register(handle_ask_course, StateFilter(ConfigureUserState.Course), NumCallback.filter())
     router.callback_query.register(handle_ask_group, StateFilter(ConfigureUserState.Group), NumCallback.filter())
-    router.callback_query.register(handle_ask_subgroup, StateFilter(ConfigureUserState.SubGroup), NumCallback.filter())
+    router.callback_query.register(handle_ask_subgroup, StateFilter(ConfigureUserState.SubGroup), NumCallback.filter(), flags={"registered": True})
     
     
\ No newline at end of file
@@ -16,7 +16,7 @@ logger = logging.getLogger(__name__)
 async def handle_configure_group(message: types.Message, state: FSMContext, groups_database: database.GroupsDatabase):
     logger.info(f"User '{message.from_user.id}' has started registration")
     
-    with groups_database.get_groups() as groups:
+    async with groups_database.get_groups() as groups:
         msg_text, keyboard = utils.generate_choice_message(groups)
         
     keyboard.row(keyboards.CANCEL_BUTTON)
@@ -29,7 +29,7 @@ async def handle_ask_faculty(call: types.CallbackQuery, callback_data: NumCallba
     await call.answer()
     await state.update_data(faculty=callback_data.num)
     
-    with groups_database.get_groups() as groups:
+    async with groups_database.get_groups() as groups:
         faculty = groups[callback_data.num]
         msg_text, keyboard = utils.generate_choice_message(faculty.forms)
     
@@ -46,7 +46,7 @@ async def handle_ask_form(call: types.CallbackQuery, callback_data: NumCallback,
     
     faculty: int = await state.get_value("faculty")
     
-    with groups_database.get_groups() as groups:
+    async with groups_database.get_groups() as groups:
         form = groups[faculty].forms[callback_data.num]
         msg_text, keyboard = utils.generate_choice_message(form.stages)
     
@@ -64,7 +64,7 @@ async def handle_ask_stage(call: types.CallbackQuery, callback_data: NumCallback
     faculty: int = await state.get_value("faculty")
     form: int = await state.get_value("form")
     
-    with groups_database.get_groups() as groups:
+    async with groups_database.get_groups() as groups:
         stage = groups[faculty].forms[form].stages[callback_data.num]
         msg_text, keyboard = utils.generate_choice_message(stage.courses)
     
@@ -83,7 +83,7 @@ async def handle_ask_course(call: types.CallbackQuery, callback_data: NumCallbac
     form: int = await state.get_value("form")
     stage: int = await state.get_value("stage")
     
-    with groups_database.get_groups() as groups:
+    async with groups_database.get_groups() as groups:
         course = groups[faculty].forms[form].stages[stage].courses[callback_data.num]
         msg_text, keyboard = utils.generate_choice_message(course.groups)
 
@@ -102,7 +102,7 @@ async def handle_ask_group(call: types.CallbackQuery, callback_data: NumCallback
     stage: int = await state.get_value("stage")
     course: int = await state.get_value("course")
     
-    with groups_database.get_groups() as groups:
+    async with groups_database.get_groups() as groups:
         group = groups[faculty].forms[form].stages[stage].courses[course].groups[callback_data.num]
     
     await state.update_data(group_id=group.id)
@@ -123,7 +123,7 @@ async def handle_ask_group(call: types.CallbackQuery, callback_data: NumCallback
     await state.set_state(RegisterUserState.SubGroup)
     
 
-async def handle_ask_subgroup(call: types.CallbackQuery, callback_data: NumCallback, state: FSMContext, users_database: database.UsersDatabase):
+async def handle_ask_subgroup(call: types.CallbackQuery, callback_data: NumCallback, state: FSMContext, users_database: database.AsyncUsersDatabase, schedules_database: database.SchedulesDatabase):
     await call.answer()
     
     data = await state.get_data()
@@ -132,7 +132,9 @@ async def handle_ask_subgroup(call: types.CallbackQuery, callback_data: NumCallb
     subgroup = callback_data.num if callback_data.num > 0 else None
     user_id = call.from_user.id
     
-    users_database.insert_user(models.User(user_id, models.UserGroupWithName(group_name, group_id, subgroup)))
+    user = models.User(user_id, models.UserGroupWithName(group_name, group_id, subgroup))
+    await users_database.insert_user(user)
+    schedules_database.prefetch_subjects_later(user.group.without_name())
     
     await call.message.edit_text("<b>Отлично, всё готово!</b> 🎉")
     
@@ -15,20 +15,18 @@ from aiogram_dialog.widgets.kbd.group import Group
 
 from datetime import datetime, timedelta, date, time
 
-from itertools import islice
-from cytoolz.itertoolz import unique
-
 from states import NoteCreationState
 from callbacks import NumCallback
-from handlers.utils import check_user_exists
 
 import operator
 
 import keyboards
 import database
 import utils
+import dateformat
 import parse
 import models
+import reminders
 
 
 class DueDateDialogState(StatesGroup):
@@ -42,48 +40,20 @@ async def handle_new_reminder(
     state: FSMContext,
     dialog_manager: DialogManager,
     schedules_database: database.SchedulesDatabase,
-    users_database: database.UsersDatabase,
+    user: models.User,
 ):
-    if not await check_user_exists(message, users_database=users_database):
-        return
-    
-    user = users_database.get_user_by_id(message.from_user.id)
-    assert(user is not None)
-
     async with ChatActionSender(bot=bot, chat_id=message.chat.id, action=ChatAction.TYPING):
         msg_date = message.date.astimezone(utils.DEFAULT_TIMEZONE)
-        found_subject: parse.ScheduleSubject | None = None
-        recent_subject = None
+        schedule = await schedules_database.get_schedule(user.group.without_name(), date_from=msg_date.date())
+        
+        found_subject = schedule.current(msg_date) if schedule is not None else None
+        recent_subject = schedule.last_finished(msg_date) if schedule is not None else None
         
-        with schedules_database.get_subjects(user.group.without_name(), date_from=msg_date.date()) as subjects:
-            # Make sure the subjects are sorted
-            subjects.sort(key=lambda x: x.time_end)
-            
-            for subj in reversed(subjects):
-                if msg_date < subj.time_end:
-                    continue
-                
-                recent_subject = subj
-                break
-            
-        with schedules_database.get_subjects(user.group.without_name(), date_from=msg_date.date()) as subjects:
-            # Make sure the subjects are sorted
-            subjects.sort(key=lambda x: x.time_end)
-            
-            for subject in subjects:
-                start = subject.time_start - timedelta(minutes=3)
-                end = subject.time_end + timedelta(minutes=7)
-                
-                if start <= msg_date <= end:
-                    found_subject = subject
-                    break
-            
         if found_subject is None:
             await dialog_manager.start(DueDateDialogState.NoSubjectCurrently,
                                        mode=StartMode.RESET_STACK,
                                        data={'subject': recent_subject.name,
-                                             'note_text': message.text,
-                                             'user': user})
+                                             'note_text': message.text})
         else:
             builder = InlineKeyboardBuilder()
             builder.row(keyboards.INLINE_YES_BUTTON, keyboards.INLINE_NO_BUTTON)
@@ -91,9 +61,8 @@ async def handle_new_reminder(
             
             await message.reply(f"Сейчас идёт пара \"<b>{found_subject.name}</b>\", верно?",
                                 reply_markup=builder.as_markup())
-            await state.update_data(subject=found_subject)
+            await state.update_data(subject=found_subject.name)
             await state.update_data(note_text=message.text)
-            await state.update_data(user=user)
             await state.set_state(NoteCreationState.IsCurrentSubjectCorrect)
 
 
@@ -101,17 +70,14 @@ async def handle_subject_not_correct(
     call: types.CallbackQuery,
     state: FSMContext,
     schedules_database: database.SchedulesDatabase,
-    users_database: database.UsersDatabase
+    user: models.User
 ):
     await call.answer()
     
-    user = users_database.get_user_by_id(call.from_user.id)
-    assert(user is not None)
+    schedule = await schedules_database.get_schedule(user.group.without_name())
+    assert(schedule is not None)
     
-    with schedules_database.get_subjects(user.group.without_name()) as subjects:
-        assert(subjects is not None)
-        
-    subject_names = set((subj.name for subj in subjects))
+    subject_names = schedule.subject_names()
     
     await state.update_data(subject_names=tuple(subject_names))
     
@@ -131,41 +97,45 @@ async def handle_subject_not_correct(
     await state.set_state(NoteCreationState.AskCustomSubject)
 
 
-def get_next_classes(schedules_database: database.SchedulesDatabase, user: models.User, subject: str, count: int) -> list[parse.ScheduleSubject]:
+async def get_next_classes(schedules_database: database.SchedulesDatabase, user: models.User, subject: str, count: int) -> list[parse.ScheduleSubject]:
     now = utils.tz_now()
-    with schedules_database.get_subjects(user.group.without_name(), date_from=now.date()) as schedules:
-        next_classes = islice(unique(filter(lambda subj: subj.name == subject and subj.time_end.date() > now.date(), schedules), key=lambda subj: subj.time_start.date()), count)
-    return list(next_classes)
+    schedule = await schedules_database.get_schedule(user.group.without_name(), date_from=now.date())
+    if schedule is None:
+        return []
+    return schedule.next_occurrences(subject, now.date(), count)
+
+
+def class_starts(classes: list[parse.ScheduleSubject]) -> list[int]:
+    # Dialog data is persisted, so only the start times of the classes are kept in it
+    return [int(subject.time_start.timestamp()) for subject in classes]
 
 
 async def handle_subject_is_correct(
     call: types.CallbackQuery,
     state: FSMContext,
     dialog_manager: DialogManager,
-    schedules_database: database.SchedulesDatabase
+    schedules_database: database.SchedulesDatabase,
+    user: models.User
 ):
     await call.answer()
     
-    subject: parse.ScheduleSubject = await state.get_value('subject')
+    subject: str = await state.get_value('subject')
     note_text = await state.get_value("note_text")
-    user = await state.get_value("user")
     
     await state.clear()
     
-    next_classes = get_next_classes(schedules_database, user, subject.name, 3)
+    next_classes = await get_next_classes(schedules_database, user, subject, 3)
     if len(next_classes) > 0:
         await dialog_manager.start(DueDateDialogState.AskDueDate,
                                 mode=StartMode.RESET_STACK,
-                                data={'subject': subject.name,
+                                data={'subject': subject,
                                       'note_text': note_text,
-                                      'user': user,
-                                      'next_classes': next_classes})
+                                      'next_classes': class_starts(next_classes)})
     else:
         await dialog_manager.start(DueDateDialogState.AskCustomDueDate,
                                 mode=StartMode.RESET_STACK,
-                                data={'subject': subject.name,
-                                      'note_text': note_text,
-                                      'user': user,})
+                                data={'subject': subject,
+                                      'note_text': note_text})
 
 
 async def handle_get_custom_subject(
@@ -173,38 +143,35 @@ async def handle_get_custom_subject(
     callback_data: NumCallback,
     state: FSMContext,
     dialog_manager: DialogManager,
-    schedules_database: database.SchedulesDatabase
+    schedules_database: database.SchedulesDatabase,
+    user: models.User
 ):
     await call.answer()
     
     note_text = await state.get_value("note_text")
     subject_name = (await state.get_value('subject_names'))[callback_data.num]
-    user = await state.get_value('user')
     
     await state.clear()
     
-    next_classes = get_next_classes(schedules_database, user, subject_name, 3)
+    next_classes = await get_next_classes(schedules_database, user, subject_name, 3)
     
     await dialog_manager.start(DueDateDialogState.AskDueDate,
                                mode=StartMode.RESET_STACK,
                                data={'subject': subject_name,
                                      'note_text': note_text,
-                                     'user': user,
-                                     'next_classes': next_classes})
+                                     'next_classes': class_starts(next_classes)})
 
 
 async def handle_create_note(call: types.CallbackQuery, state: FSMContext, dialog_manager: DialogManager):
     await call.answer()
     
     note_text = await state.get_value("note_text")
-    user = await state.get_value("user")
     
     await state.clear()
     
     await dialog_manager.start(DueDateDialogState.AskCustomDueDate,
                                mode=StartMode.RESET_STACK,
-                               data={'note_text': note_text,
-                                     'user': user})
+                               data={'note_text': note_text})
 
 
 async def handle_due_date_selected(
@@ -213,20 +180,21 @@ async def handle_due_date_selected(
     manager: DialogManager,
     selected_date: date
 ):  
-    subject: parse.ScheduleSubject | None = manager.start_data.get('subject', None)
+    subject: str | None = manager.start_data.get('subject', None)
     note_text: str = manager.start_data['note_text']
-    user: models.User = manager.start_data['user']
-    notes_database: database.NotesDatabase = manager.middleware_data['notes_database']
+    user: models.User = manager.middleware_data['user']
+    notes_database: database.AsyncNotesDatabase = manager.middleware_data['notes_database']
+    reminder_scheduler: reminders.ReminderScheduler = manager.middleware_data['reminder_scheduler']
     
     if selected_date < utils.tz_now().date():
         await call.message.reply("❗ Дата не должна быть раньше сегодняшнего дня.")
         await manager.done()
         return
     
-    with utils.time_locale('ru_RU.UTF-8'):
-        date_text: str = selected_date.strftime("%d %b %Y")
+    date_text: str = dateformat.day_month_year(selected_date)
     
-    notes_database.insert_note(models.UserNote(user.id, subject, note_text, datetime.combine(selected_date - timedelta(days=1), time(hour=23, minute=59), tzinfo=utils.DEFAULT_TIMEZONE)))
+    note_id = await notes_database.insert_note(models.UserNote(user.id, subject, note_text, datetime.combine(selected_date - timedelta(days=1), time(hour=23, minute=59), tzinfo=utils.DEFAULT_TIMEZONE)))
+    await reminder_scheduler.update_note(note_id)
     
     if subject is not None:
         await call.message.edit_text(f"✅ Сохранено задание по предмету <b>{subject}</b>: \"{note_text}\" к <b>{date_text}</b>.")
@@ -237,12 +205,12 @@ async def handle_due_date_selected(
 
 
 async def on_class_selected(call: types.CallbackQuery, widget, manager: DialogManager, item_id: int):
-    next_class: parse.ScheduleSubject = manager.start_data['next_classes'][item_id]
+    next_class_start = datetime.fromtimestamp(manager.start_data['next_classes'][item_id], tz=utils.DEFAULT_TIMEZONE)
     
-    await handle_due_date_selected(call, widget, manager, selected_date=next_class.time_start.date())
+    await handle_due_date_selected(call, widget, manager, selected_date=next_class_start.date())
 
 async def no_subject_currently_getter(dialog_manager: DialogManager, **kwargs):
-    subject: parse.ScheduleSubject = dialog_manager.start_data['subject']
+    subject: str = dialog_manager.start_data['subject']
     return {
         'recent_subject': subject
     }
@@ -258,18 +226,18 @@ async def ask_deadline_getter(dialog_manager: DialogManager, **kwargs):
     def map_subject():
         now = utils.tz_now()
         
-        def inner(subject: parse.ScheduleSubject) -> str:
-            with utils.time_locale('ru_RU.UTF-8'):
-                delta = subject.time_start - now
-                date_text = subject.time_start.strftime("%a, %d %b")
-                if delta.days == 0:
-                    text = f"{date_text} (завтра)"
-                elif delta.days == 1:
-                    text = f"{date_text} (послезавтра)"
-                else:
-                    text = f"{date_text} (Через {delta.days} д.)"
-                
-                return (subject.time_start, text)
+        def inner(timestamp: int) -> str:
+            time_start = datetime.fromtimestamp(timestamp, tz=utils.DEFAULT_TIMEZONE)
+            delta = time_start - now
+            date_text = dateformat.weekday_day_month(time_start)
+            if delta.days == 0:
+                text = f"{date_text} (завтра)"
+            elif delta.days == 1:
+                text = f"{date_text} (послезавтра)"
+            else:
+                text = f"{date_text} (Через {delta.days} д.)"
+            
+            return (time_start, text)
         return inner
     
     next_classes = map(map_subject(), dialog_manager.start_data['next_classes'])
@@ -284,10 +252,10 @@ async def on_recent_subject_button_click(call: types.CallbackQuery, button: Butt
         return
     
     schedules_database: database.SchedulesDatabase = manager.middleware_data['schedules_database']
-    user: models.User = manager.start_data['user']
+    user: models.User = manager.middleware_data['user']
     subject: str = manager.start_data['subject']
     
-    manager.start_data['next_classes'] = get_next_classes(schedules_database, user, subject, 3)
+    manager.start_data['next_classes'] = class_starts(await get_next_classes(schedules_database, user, subject, 3))
     
     await manager.next()
     
@@ -303,16 +271,14 @@ async def on_create_note_button_click(call: types.CallbackQuery, button: Button,
 async def on_custom_subject_button_click(call: types.CallbackQuery, button: Button, manager: DialogManager):
     state: FSMContext = manager.middleware_data['state']
     schedules_database: database.SchedulesDatabase = manager.middleware_data['schedules_database']
-    users_database: database.SchedulesDatabase = manager.middleware_data['users_database']
-    user: models.User = manager.start_data['user']
-    note_text: models.User = manager.start_data['note_text']
+    user: models.User = manager.middleware_data['user']
+    note_text: str = manager.start_data['note_text']
     
     await manager.done()
     
-    await state.update_data(user=user)
     await state.update_data(note_text=note_text)
     
-    await handle_subject_not_correct(call, state, schedules_database, users_database)
+    await handle_subject_not_correct(call, state, schedules_database, user)
 
 
 async def on_cancel_button_click(call: types.CallbackQuery, button: Button, manager: DialogManager):
@@ -320,11 +286,11 @@ async def on_cancel_button_click(call: types.CallbackQuery, button: Button, mana
 
 
 def register(router: Router):
-    router.message.register(handle_new_reminder, StateFilter(None))
-    router.callback_query.register(handle_subject_not_correct, StateFilter(NoteCreationState.IsCurrentSubjectCorrect), F.data == keyboards.INLINE_NO_BUTTON.callback_data)
-    router.callback_query.register(handle_subject_is_correct, StateFilter(NoteCreationState.IsCurrentSubjectCorrect), F.data == keyboards.INLINE_YES_BUTTON.callback_data)
+    router.message.register(handle_new_reminder, StateFilter(None), flags={"registered": True})
+    router.callback_query.register(handle_subject_not_correct, StateFilter(NoteCreationState.IsCurrentSubjectCorrect), F.data == keyboards.INLINE_NO_BUTTON.callback_data, flags={"registered": True})
+    router.callback_query.register(handle_subject_is_correct, StateFilter(NoteCreationState.IsCurrentSubjectCorrect), F.data == keyboards.INLINE_YES_BUTTON.callback_data, flags={"registered": True})
     router.callback_query.register(handle_create_note, StateFilter(NoteCreationState.AskCustomSubject), F.data == keyboards.INLINE_CREATE_NOTE_BUTTON.callback_data)
-    router.callback_query.register(handle_get_custom_subject, StateFilter(NoteCreationState.AskCustomSubject), NumCallback.filter())
+    router.callback_query.register(handle_get_custom_subject, StateFilter(NoteCreationState.AskCustomSubject), NumCallback.filter(), flags={"registered": True})
 
     router.include_router(Dialog(
         Window(
@@ -20,6 +20,8 @@ from callbacks import NoteEditCallback
 import database
 import models
 import utils
+import dateformat
+import reminders
 
 class NoteEditMenuDialog(StatesGroup):
     first = State()
@@ -37,10 +39,12 @@ async def handle_reminder_edit_menu(call: types.CallbackQuery, callback_data: No
 
 
 async def on_delete_button_click(call: types.CallbackQuery, button: Button, dialog_manager: DialogManager):
-    notes_database: database.NotesDatabase = dialog_manager.middleware_data['notes_database']
+    notes_database: database.AsyncNotesDatabase = dialog_manager.middleware_data['notes_database']
+    reminder_scheduler: reminders.ReminderScheduler = dialog_manager.middleware_data['reminder_scheduler']
     note_id = dialog_manager.start_data['note_id']
     
-    notes_database.delete_note_by_id(note_id)
+    await notes_database.delete_note_by_id(note_id)
+    reminder_scheduler.remove_note(note_id)
     
     await call.message.edit_text("✅ Напоминание успешно удалено!")
     
@@ -57,11 +61,13 @@ async def on_edit_due_date_button_click(call: types.CallbackQuery, button: Butto
     await dialog_manager.start(NoteEditDueDateDialog.first, data={'note_id': note_id}, mode=StartMode.RESET_STACK)
 
 async def on_change_staus_button_click(call: types.CallbackQuery, button: Button, dialog_manager: DialogManager):
-    notes_database: database.NotesDatabase = dialog_manager.middleware_data['notes_database']
+    notes_database: database.AsyncNotesDatabase = dialog_manager.middleware_data['notes_database']
+    reminder_scheduler: reminders.ReminderScheduler = dialog_manager.middleware_data['reminder_scheduler']
     note_id = dialog_manager.start_data['note_id']
-    note = notes_database.get_note_by_id(note_id)
+    note = await notes_database.get_note_by_id(note_id)
     
-    notes_database.update_note_completed(note.id, not note.is_completed)
+    await notes_database.update_note_completed(note.id, not note.is_completed)
+    await reminder_scheduler.update_note(note.id)
     
     await call.message.edit_text("✅ Статус напоминания успешно изменён!")
     
@@ -72,10 +78,10 @@ async def on_cancel_button_click(call: types.CallbackQuery, button: Button, dial
     
 
 async def on_new_text_input_success(message: types.Message, text_input: TextInput, dialog_manager: DialogManager, data: str):
-    notes_database: database.NotesDatabase = dialog_manager.middleware_data['notes_database']
+    notes_database: database.AsyncNotesDatabase = dialog_manager.middleware_data['notes_database']
     note_id = dialog_manager.start_data['note_id']
     
-    notes_database.update_note_text(note_id, data)
+    await notes_database.update_note_text(note_id, data)
     
     await message.reply("✅ Текст напоминания успешно изменён!")
     
@@ -93,10 +99,12 @@ async def on_new_due_date_selected(
         await manager.done()
         return
     
-    notes_database: database.NotesDatabase = manager.middleware_data['notes_database']
+    notes_database: database.AsyncNotesDatabase = manager.middleware_data['notes_database']
+    reminder_scheduler: reminders.ReminderScheduler = manager.middleware_data['reminder_scheduler']
     note_id = manager.start_data['note_id']
     
-    notes_database.update_note_due_date(note_id, datetime.combine(selected_date - timedelta(days=1), time(hour=23, minute=59), tzinfo=utils.DEFAULT_TIMEZONE))
+    await notes_database.update_note_due_date(note_id, datetime.combine(selected_date - timedelta(days=1), time(hour=23, minute=59), tzinfo=utils.DEFAULT_TIMEZONE))
+    await reminder_scheduler.update_note(note_id)
     
     await call.message.edit_text("✅ Дедлайн напоминания успешно обновлён!")
     await manager.done()
@@ -110,12 +118,11 @@ async def edit_duedate_getter(dialog_manager: DialogManager, **kwargs):
     
     
 async def menu_getter(dialog_manager: DialogManager, **kwargs):
-    notes_database: database.NotesDatabase = dialog_manager.middleware_data['notes_database']
+    notes_database: database.AsyncNotesDatabase = dialog_manager.middleware_data['notes_database']
     note_id = dialog_manager.start_data['note_id']
-    note = notes_database.get_note_by_id(note_id)
+    note = await notes_database.get_note_by_id(note_id)
     
-    with utils.time_locale('ru_RU.UTF-8'):
-        date_text: str = note.due_date.strftime("%d %b %Y")
+    date_text: str = dateformat.day_month_year(note.due_date)
     
     if note.is_completed:
         reminder_text = f"<s>\"{note.text}\" — к {date_text}</s>"
@@ -0,0 +1,40 @@
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, types
+from aiogram.dispatcher.flags import get_flag
+
+import database
+
+NOT_REGISTERED_TEXT = "Я тебя не знаю. Пожалуйста, напиши /start и пройди регистрацию."
+
+class UserMiddleware(BaseMiddleware):
+    """Loads the profile of the user behind the update once and passes it to handlers as `user`."""
+
+    async def __call__(
+        self,
+        handler: Callable[[types.TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: types.TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        from_user: types.User | None = data.get('event_from_user')
+        users_database: database.AsyncUsersDatabase = data['users_database']
+
+        data['user'] = await users_database.get_user_by_id(from_user.id) if from_user is not None else None
+        return await handler(event, data)
+
+class RegisteredUserMiddleware(BaseMiddleware):
+    """Stops handlers registered with the `registered` flag from running for unknown users."""
+
+    async def __call__(
+        self,
+        handler: Callable[[types.TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: types.TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        if not get_flag(data, 'registered') or data.get('user') is not None:
+            return await handler(event, data)
+
+        if isinstance(event, types.CallbackQuery):
+            await event.answer(NOT_REGISTERED_TEXT, show_alert=True)
+        elif isinstance(event, types.Message):
+            await event.answer(NOT_REGISTERED_TEXT)
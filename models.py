@@ -2,6 +2,7 @@ from typing import Optional
 from dataclasses import dataclass, field
 from datetime import datetime
 from datetime import timedelta
+from enum import IntEnum
 import uuid
 
 type UserId = int
@@ -45,3 +46,17 @@ class UserNote:
     
     def __hash__(self):
         return hash(self.id)
+
+class ReminderState(IntEnum):
+    PENDING = 0
+    CLAIMED = 1
+    SENT = 2
+    FAILED = 3
+    DROPPED = 4
+
+@dataclass
+class QueuedReminder:
+    note_id: int
+    reminder_index: int
+    user_id: UserId
+    attempts: int = 0
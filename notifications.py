@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+
+import models
+
+logger = logging.getLogger(__name__)
+
+# https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+# How long shutdown waits for the notifications being sent and the recording of their outcome
+CLOSE_TIMEOUT = 10.0
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> float:
+        """Takes a token and returns 0, or returns how many seconds to wait for one."""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        while (delay := self.try_acquire()) > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def is_full(self) -> bool:
+        self.refill(time.monotonic())
+        return self.tokens >= self.capacity and time.monotonic() >= self.paused_until
+
+@dataclass
+class Notification:
+    note: models.UserNote
+    user: models.User
+    attempts: int = 0
+    queued_at: float = field(default_factory=time.monotonic)
+
+@dataclass
+class DispatcherStats:
+    sent: int = 0
+    failed: int = 0
+    retried: int = 0
+    latency_total: float = 0.0
+    latency_max: float = 0.0
+
+    @property
+    def latency_avg(self) -> float:
+        return self.latency_total / self.sent if self.sent > 0 else 0.0
+
+class NotificationDispatcher:
+    """Sends notifications from a bounded pool of workers within Telegram's global and per-chat limits."""
+
+    def __init__(
+        self,
+        send: Callable[[Notification], Awaitable[None]],
+        on_sent: Callable[[Notification], Awaitable[None]],
+        on_failed: Callable[[Notification], Awaitable[None]],
+        workers: int = 8
+    ):
+        self.send = send
+        self.on_sent = on_sent
+        self.on_failed = on_failed
+        self.workers_count = workers
+        self.queue: asyncio.Queue[Notification] = asyncio.Queue()
+        self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self.chat_buckets: dict[models.UserId, TokenBucket] = {}
+        self.pending: set[int] = set()
+        # Set whenever a notification leaves `pending`
+        self.slot_freed = asyncio.Event()
+        self.workers: list[asyncio.Task] = []
+        # Workers that took a notification off the queue and have not finished with it yet
+        self.busy_workers: set[asyncio.Task] = set()
+        self.closing = False
+        self.stats = DispatcherStats()
+
+    def start(self):
+        for _ in range(self.workers_count):
+            self.workers.append(asyncio.create_task(self.worker()))
+
+    async def close(self, timeout: float = CLOSE_TIMEOUT):
+        # A notification cancelled mid-send would be sent again after the restart, so those are finished first.
+        # Queued ones stay claimed in the outbox and are released on the next start.
+        self.closing = True
+        for worker in self.workers:
+            if worker not in self.busy_workers:
+                worker.cancel()
+        _, unfinished = await asyncio.wait(self.workers, timeout=timeout) if len(self.workers) > 0 else (set(), set())
+        if len(unfinished) > 0:
+            logger.warning(f"Cancelling {len(unfinished)} notifications still being sent after {timeout} s")
+        for worker in unfinished:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers.clear()
+
+        stats = self.stats
+        logger.info(f"Notifications: {stats.sent} sent, {stats.failed} failed, {stats.retried} retries, {len(self.pending)} left pending, "
+                    f"send latency avg {stats.latency_avg * 1000:.0f} ms, max {stats.latency_max * 1000:.0f} ms")
+
+    def submit(self, note: models.UserNote, user: models.User) -> bool:
+        if note.id in self.pending:
+            return False
+        self.pending.add(note.id)
+        self.queue.put_nowait(Notification(note, user))
+        return True
+
+    def requeue(self, notification: Notification, delay: float):
+        asyncio.get_running_loop().call_later(delay, self.queue.put_nowait, notification)
+
+    def chat_bucket(self, chat_id: models.UserId) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            # Forget chats that have been idle long enough to refill completely
+            if len(self.chat_buckets) > 10000:
+                self.chat_buckets = {k: v for k, v in self.chat_buckets.items() if not v.is_full()}
+            bucket = self.chat_buckets[chat_id] = TokenBucket(CHAT_RATE, CHAT_RATE)
+        return bucket
+
+    async def finish(self, notification: Notification, sent: bool):
+        self.pending.discard(notification.note.id)
+        self.slot_freed.set()
+        try:
+            if sent:
+                await self.on_sent(notification)
+            else:
+                await self.on_failed(notification)
+        except Exception as e:
+            logger.exception(f"Failed to process result of notification for note '{notification.note.id}': {e}")
+
+    async def worker(self):
+        while not self.closing:
+            notification = await self.queue.get()
+            self.busy_workers.add(asyncio.current_task())
+            try:
+                await self.process(notification)
+            finally:
+                self.busy_workers.discard(asyncio.current_task())
+                self.queue.task_done()
+
+    async def process(self, notification: Notification):
+        chat_id = notification.note.user_id
+
+        delay = self.chat_bucket(chat_id).try_acquire()
+        if delay > 0:
+            self.requeue(notification, delay)
+            return
+
+        await self.global_bucket.acquire()
+
+        notification.attempts += 1
+        started = time.monotonic()
+        try:
+            await self.send(notification)
+        except TelegramRetryAfter as e:
+            logger.warning(f"Flood control exceeded, retrying note '{notification.note.id}' in {e.retry_after} s")
+            self.global_bucket.pause(e.retry_after)
+            self.stats.retried += 1
+            self.requeue(notification, e.retry_after)
+            return
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            logger.error(f"Failed to send notification for note '{notification.note.id}' to user '{chat_id}': {e}")
+            self.stats.failed += 1
+            await self.finish(notification, sent=False)
+            return
+        except Exception as e:
+            if notification.attempts >= MAX_ATTEMPTS:
+                logger.error(f"Failed to send notification for note '{notification.note.id}' to user '{chat_id}' after {notification.attempts} attempts: {e}")
+                self.stats.failed += 1
+                await self.finish(notification, sent=False)
+            else:
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (notification.attempts - 1))
+                logger.warning(f"Failed to send notification for note '{notification.note.id}', retrying in {delay} s: {e}")
+                self.stats.retried += 1
+                self.requeue(notification, delay)
+            return
+
+        latency = time.monotonic() - started
+        self.stats.sent += 1
+        self.stats.latency_total += latency
+        self.stats.latency_max = max(self.stats.latency_max, latency)
+
+        logger.info(f"Sent notification for note '{notification.note.id}' to user '{chat_id}' in {latency * 1000:.0f} ms "
+                    f"({(time.monotonic() - notification.queued_at) * 1000:.0f} ms after it was due)")
+
+        await self.finish(notification, sent=True)
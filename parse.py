@@ -1,5 +1,11 @@
 import requests
+import aiohttp
+import asyncio
 import bs4
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass
 from datetime import datetime, time, date
 import re
@@ -11,6 +17,22 @@ HERZEN_URL = "https://old-guide.herzen.spb.ru"
 GROUPS_URL = f"{HERZEN_URL}/static/schedule.php"
 SCHEDULE_DATA_URL = f"{HERZEN_URL}/static/schedule_dates.php"
 
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36"
+REQUEST_TIMEOUT = 5
+MAX_CONNECTIONS_PER_HOST = 4
+
+# "html.parser" or "lxml", both produce the same subjects and groups
+PARSER_BACKENDS = ("html.parser", "lxml")
+DEFAULT_PARSER_BACKEND = "html.parser"
+
+NO_CLASSES_MARKER = ">другую группу</a>"
+CLASS_MOD_DATES_RE = re.compile(r'(\d\d\.\d\d—\d\d\.\d\d)|'
+                                r'(\d\.\d\d—\d\.\d\d)|'
+                                r'(\d\.\d\d—\d\d\.\d\d)|'
+                                r'(\d\d\.\d\d—\d\.\d\d)|'
+                                r'(\d\d\.\d\d)|(\d\.\d\d)')
+CLASS_MOD_EXTRA_RE = re.compile(r'(\()|(\))|(\* дистанционное обучение)')
+
 @dataclass(frozen=True)
 class ScheduleGroup:
     name: str
@@ -57,14 +79,62 @@ class Schedule:
 
 logger = logging.getLogger(__name__)
 
-def parse_groups() -> list[ScheduleFaculty] | None:
-    res = requests.get(GROUPS_URL, {
-        'User-Agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36"
-    }, timeout=5)
-    if res.status_code != 200:
-        logger.error(f"Failed to fetch groups: {res.status_code} {res.reason}")
-        return None
-    bs = bs4.BeautifulSoup(res.content, "html.parser")
+@dataclass(frozen=True)
+class Page:
+    # None if the page has not been modified since the given ETag / Last-Modified
+    content: bytes | None
+    etag: str | None
+    last_modified: str | None
+
+class HttpClient:
+    """Shared keep-alive connection pool for requests to the university site."""
+    
+    def __init__(self, limit_per_host: int = MAX_CONNECTIONS_PER_HOST, timeout: float = REQUEST_TIMEOUT):
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.session: aiohttp.ClientSession | None = None
+        
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=self.limit_per_host, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={'User-Agent': USER_AGENT}
+            )
+        return self.session
+        
+    async def get_page(self, url: str, etag: str | None = None, last_modified: str | None = None) -> Page | None:
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+            
+        try:
+            async with self.get_session().get(url, headers=headers) as res:
+                if res.status == 304:
+                    return Page(content=None, etag=etag, last_modified=last_modified)
+                if res.status != 200:
+                    logger.error(f"Failed to fetch '{url}': {res.status} {res.reason}")
+                    return None
+                return Page(content=await res.read(), etag=res.headers.get('ETag'), last_modified=res.headers.get('Last-Modified'))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Failed to fetch '{url}': {e!r}")
+            return None
+        
+    async def get(self, url: str) -> bytes | None:
+        page = await self.get_page(url)
+        return page.content if page is not None else None
+        
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+http_client = HttpClient()
+
+def parse_groups_page(content: bytes, backend: str = DEFAULT_PARSER_BACKEND) -> list[ScheduleFaculty]:
+    bs = bs4.BeautifulSoup(content, backend)
     
     schedule_ids: list[ScheduleFaculty] = []
     index = 0
@@ -105,45 +175,66 @@ def parse_groups() -> list[ScheduleFaculty] | None:
         index += 1
     return schedule_ids
 
-def parse_schedule(group_id: str, subgroup_id: int | None = None, date_from: date | None = None, date_to: date | None = None) -> list[ScheduleSubject] | None:
-    url = f"{SCHEDULE_DATA_URL}?id_group={group_id}"
-    with utils.time_locale('ru_RU.UTF-8'):
-        if date_from is not None:
-            url += f"&date1={date_from.strftime('%Y-%m-%d')}"
-        if date_to is not None:
-            url += f"&date2={date_to.strftime('%Y-%m-%d')}"
-    
-    res = requests.get(url, {
-        'User-Agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36"
-    }, timeout=5)
+def parse_groups() -> list[ScheduleFaculty] | None:
+    res = requests.get(GROUPS_URL, headers={'User-Agent': USER_AGENT}, timeout=REQUEST_TIMEOUT)
     if res.status_code != 200:
         logger.error(f"Failed to fetch groups: {res.status_code} {res.reason}")
         return None
-    
-    bs = bs4.BeautifulSoup(res.content, "html.parser")
-    
-    if bs.find('a', string='другую группу'):  # No classes at that period
-    #     last_summer_day = datetime.datetime(date_1.year, 8, 31).date()
-    #     if date_1 <= last_summer_day < date_2:
-    #         return parse_date_schedule(group_id, subgroup_id, last_summer_day + datetime.timedelta(days=1), date_2)
+    return parse_groups_page(res.content)
+
+def schedule_url(group_id: str, date_from: date | None = None, date_to: date | None = None) -> str:
+    url = f"{SCHEDULE_DATA_URL}?id_group={group_id}"
+    if date_from is not None:
+        url += f"&date1={date_from.isoformat()}"
+    if date_to is not None:
+        url += f"&date2={date_to.isoformat()}"
+    return url
+
+def parse_schedule(group_id: str, subgroup_id: int | None = None, date_from: date | None = None, date_to: date | None = None) -> list[ScheduleSubject] | None:
+    res = requests.get(schedule_url(group_id, date_from, date_to), headers={'User-Agent': USER_AGENT}, timeout=REQUEST_TIMEOUT)
+    if res.status_code != 200:
+        logger.error(f"Failed to fetch schedule: {res.status_code} {res.reason}")
         return None
+    return parse_schedule_page(res.content, subgroup_id)
+
+async def fetch_schedule_page(group_id: str, date_from: date | None = None, date_to: date | None = None, etag: str | None = None, last_modified: str | None = None) -> Page | None:
+    return await http_client.get_page(schedule_url(group_id, date_from, date_to), etag, last_modified)
+
+def parse_schedule_page(content: bytes, subgroup_id: int | None = None, backend: str = DEFAULT_PARSER_BACKEND) -> list[ScheduleSubject] | None:
+    if backend == "lxml":
+        # Only the table is built into a tree, the rest of the page is skipped by the C tokenizer
+        markup = bs4.UnicodeDammit(content, is_html=True).unicode_markup
+        if NO_CLASSES_MARKER in markup:  # No classes at that period
+            return None
+        bs = bs4.BeautifulSoup(markup, "lxml", parse_only=bs4.SoupStrainer('tbody'))
+    else:
+        bs = bs4.BeautifulSoup(content, "html.parser")
+        
+        if bs.find('a', string='другую группу'):  # No classes at that period
+        #     last_summer_day = datetime.datetime(date_1.year, 8, 31).date()
+        #     if date_1 <= last_summer_day < date_2:
+        #         return parse_date_schedule(group_id, subgroup_id, last_summer_day + datetime.timedelta(days=1), date_2)
+            return None
     
-    if bs.find('tbody'):
-        courses_column = bs.find('tbody').find_all('tr')
+    tbody = bs.find('tbody')
+    if tbody:
+        courses_column = tbody.find_all('tr')
     else:
         return None
 
     schedule_courses: list[ScheduleSubject] = []
     day_name = ''
-    for class_number in range(len(courses_column)):
+    dates: dict[str, datetime] = {}
+    for row in courses_column:
 
-        class_time = str(courses_column[class_number].find('th').text)
+        class_time = str(row.find('th').text)
 
-        if courses_column[class_number].find('th', {'class': 'dayname'}):
-            day_name = courses_column[class_number].find('th', {'class': 'dayname'}).text
+        day_name_th = row.find('th', {'class': 'dayname'})
+        if day_name_th:
+            day_name = day_name_th.text
             continue
 
-        course = courses_column[class_number].find_all('td')
+        course = row.find_all('td')
 
         if (len(course) > 1) and subgroup_id and (0 < subgroup_id <= len(course)):  # If multiple classes at the same time
             course = course[subgroup_id - 1]
@@ -153,6 +244,8 @@ def parse_schedule(group_id: str, subgroup_id: int | None = None, date_from: dat
         if not course.find('strong'):  # If class not found
             continue
         
+        is_distant = "дистанционное обучение" in course.text
+        
         class_names = course.find_all('strong')
         for class_name in class_names:
             class_type = class_name.next.next
@@ -167,18 +260,14 @@ def parse_schedule(group_id: str, subgroup_id: int | None = None, date_from: dat
                 class_mod = ''
             else:
                 class_mod = class_mod.text.strip()
-                class_mod = re.sub(r'(\d\d\.\d\d—\d\d\.\d\d)|'
-                                   r'(\d\.\d\d—\d\.\d\d)|'
-                                   r'(\d\.\d\d—\d\d\.\d\d)|'
-                                   r'(\d\d\.\d\d—\d\.\d\d)|'
-                                   r'(\d\d\.\d\d)|(\d\.\d\d)', '', class_mod)
-                class_mod = re.sub(r'(\()|(\))|(\* дистанционное обучение)', '', class_mod)
+                class_mod = CLASS_MOD_DATES_RE.sub('', class_mod)
+                class_mod = CLASS_MOD_EXTRA_RE.sub('', class_mod)
                 class_mod = class_mod.strip()
 
             class_teacher = ''
             class_room = ''
 
-            if "дистанционное обучение" not in course.text:
+            if not is_distant:
                 class_teacher = class_type.next.next.next
                 class_room = class_teacher.next.next
 
@@ -186,7 +275,9 @@ def parse_schedule(group_id: str, subgroup_id: int | None = None, date_from: dat
                 class_room = str(class_room.text).strip(", \n")
                 
             date_str = day_name.split(',')[0].strip()
-            date = datetime.strptime(date_str, "%d.%m.%Y")
+            date = dates.get(date_str)
+            if date is None:
+                date = dates[date_str] = datetime.strptime(date_str, "%d.%m.%Y")
             
             time_start_str, time_end_str = str(class_time).split('—')
             
@@ -210,6 +301,47 @@ def parse_schedule(group_id: str, subgroup_id: int | None = None, date_from: dat
             ))
     return schedule_courses
 
+def parse_schedule_page_tuple(content: bytes, subgroup_id: int | None = None, backend: str = DEFAULT_PARSER_BACKEND) -> tuple[ScheduleSubject, ...] | None:
+    subjects = parse_schedule_page(content, subgroup_id, backend)
+    return tuple(subjects) if subjects is not None else None
+
+class ParserPool:
+    """Parses pages off the event loop in a process or thread pool."""
+    
+    def __init__(self, executor: str = "process", workers: int | None = None, max_pending: int | None = None, backend: str = DEFAULT_PARSER_BACKEND):
+        self.workers = workers or os.cpu_count() or 1
+        self.executor: Executor = self.create_process_pool() if executor == "process" else ThreadPoolExecutor(self.workers, thread_name_prefix="parser")
+        # Callers wait here instead of piling pages up in the executor queue
+        self.pending = asyncio.Semaphore(max_pending or self.workers * 2)
+        self.backend = backend
+        
+    def create_process_pool(self) -> ProcessPoolExecutor:
+        # Forking a process that already runs the event loop and database threads can leave the children deadlocked
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(method))
+        
+    async def run(self, func, *args):
+        async with self.pending:
+            executor = self.executor
+            try:
+                return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+            except BrokenProcessPool:
+                # A crashed child breaks the whole pool, it is replaced once for everyone who was waiting on it
+                if self.executor is executor:
+                    logger.error("Parser process pool broke, starting a new one")
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self.executor = self.create_process_pool()
+                return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        
+    async def parse_schedule_page(self, content: bytes, subgroup_id: int | None = None) -> tuple[ScheduleSubject, ...] | None:
+        return await self.run(parse_schedule_page_tuple, content, subgroup_id, self.backend)
+    
+    async def parse_groups_page(self, content: bytes) -> list[ScheduleFaculty]:
+        return await self.run(parse_groups_page, content, self.backend)
+    
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
 
 if __name__ == "__main__":
     now = utils.tz_now()
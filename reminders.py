@@ -0,0 +1,297 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Callable
+
+import database
+import models
+import notifications
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH = 100
+# A full dispatcher is refilled once this many of its slots are free, not one reminder at a time
+OUTBOX_REFILL = OUTBOX_BATCH // 4
+OUTBOX_POLL_INTERVAL = 1.0
+# Long enough for a claimed reminder to get through the dispatcher's queue and retries
+CLAIM_TTL = timedelta(minutes=10)
+RETRY_BASE = 30.0
+RETRY_MAX = 3600.0
+MAX_ATTEMPTS = 8
+OUTBOX_RETENTION = timedelta(days=7)
+PURGE_INTERVAL = 3600.0
+# Pause after a failed pass, e.g. while another worker holds the database locked
+ERROR_BACKOFF = 5.0
+
+def next_fire_time(note: models.UserNote, user: models.User) -> datetime | None:
+    if note.is_completed:
+        return None
+
+    reminder_count = sum(True for t in user.reminder_times if t is not None)
+
+    # All reminders are sent, the note is completed as soon as possible
+    if note.reminded_times >= reminder_count:
+        return datetime.fromtimestamp(0, tz=note.due_date.tzinfo)
+
+    reminder_time = user.reminder_times[note.reminded_times]
+    if reminder_time is None:
+        return note.due_date
+
+    return note.due_date - reminder_time.value
+
+class ReminderScheduler:
+    """Keeps every incomplete note in a heap ordered by the time it has to be looked at again."""
+
+    def __init__(self, notes_database: database.AsyncNotesDatabase, users_database: database.AsyncUsersDatabase):
+        self.notes_database = notes_database
+        self.users_database = users_database
+        # Heap of (fire timestamp, note id). Entries are invalidated lazily through `fire_times`.
+        self.queue: list[tuple[float, int]] = []
+        self.fire_times: dict[int, float] = {}
+        self.user_notes: dict[models.UserId, set[int]] = {}
+        self.note_users: dict[int, models.UserId] = {}
+        self.wakeup = asyncio.Event()
+
+    async def load(self, owns: Callable[[models.UserId], bool] | None = None):
+        cache_users: dict[models.UserId, models.User | None] = {}
+
+        count = 0
+        _, notes = await self.notes_database.get_current_notes()
+        for note in notes:
+            if owns is not None and not owns(note.user_id):
+                continue
+
+            if note.user_id not in cache_users:
+                cache_users[note.user_id] = await self.users_database.get_user_by_id(note.user_id)
+
+            user = cache_users[note.user_id]
+            if user is None:
+                logger.error(f"Failed to schedule note '{note.id}': user '{note.user_id}' not found")
+                continue
+
+            self.schedule(note, user)
+            count += 1
+
+        logger.info(f"Scheduled {count} notes")
+
+    def schedule(self, note: models.UserNote, user: models.User, not_before: datetime | None = None):
+        fire_time = next_fire_time(note, user)
+        if fire_time is None:
+            self.remove_note(note.id)
+            return
+
+        if not_before is not None:
+            fire_time = max(fire_time, not_before)
+
+        timestamp = fire_time.timestamp()
+        self.fire_times[note.id] = timestamp
+        self.note_users[note.id] = note.user_id
+        self.user_notes.setdefault(note.user_id, set()).add(note.id)
+
+        if len(self.queue) == 0 or timestamp < self.queue[0][0]:
+            self.wakeup.set()
+        heapq.heappush(self.queue, (timestamp, note.id))
+
+    def remove_note(self, note_id: int):
+        self.fire_times.pop(note_id, None)
+        user_id = self.note_users.pop(note_id, None)
+        if user_id is not None:
+            notes = self.user_notes.get(user_id)
+            if notes is not None:
+                notes.discard(note_id)
+                if len(notes) == 0:
+                    del self.user_notes[user_id]
+
+    def remove_user(self, user_id: models.UserId):
+        for note_id in tuple(self.user_notes.get(user_id, ())):
+            self.remove_note(note_id)
+
+    def remove_users_where(self, predicate: Callable[[models.UserId], bool]):
+        for user_id in [user_id for user_id in self.user_notes if predicate(user_id)]:
+            self.remove_user(user_id)
+
+    async def update_note(self, note_id: int):
+        note = await self.notes_database.get_note_by_id(note_id)
+        if note is None or note.is_completed:
+            self.remove_note(note_id)
+            return
+
+        user = await self.users_database.get_user_by_id(note.user_id)
+        if user is None:
+            self.remove_note(note_id)
+            return
+
+        self.schedule(note, user)
+
+    async def update_user(self, user_id: models.UserId):
+        self.remove_user(user_id)
+
+        user = await self.users_database.get_user_by_id(user_id)
+        if user is None:
+            return
+
+        _, notes = await self.notes_database.get_current_notes_by_user_id(user_id)
+        for note in notes:
+            self.schedule(note, user)
+
+    def pop_due(self, now: float) -> list[int]:
+        due: list[int] = []
+        while len(self.queue) > 0 and self.queue[0][0] <= now:
+            timestamp, note_id = heapq.heappop(self.queue)
+            if self.fire_times.get(note_id) != timestamp:
+                continue
+            self.remove_note(note_id)
+            due.append(note_id)
+        return due
+
+    async def wait_due(self) -> list[int]:
+        while True:
+            self.wakeup.clear()
+
+            now = time.time()
+            due = self.pop_due(now)
+            if len(due) > 0:
+                return due
+
+            # Drop invalidated entries so that the head is the next real deadline
+            while len(self.queue) > 0 and self.fire_times.get(self.queue[0][1]) != self.queue[0][0]:
+                heapq.heappop(self.queue)
+
+            timeout = self.queue[0][0] - now if len(self.queue) > 0 else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+            except TimeoutError:
+                pass
+
+class ReminderOutbox:
+    """Sends due reminders through an outbox persisted next to the notes.
+
+    A reminder is claimed before it is sent and acknowledged in one transaction with the progress of its note,
+    so neither restarts nor other workers lose or repeat it. The exception is a crash between Telegram accepting
+    the message and the acknowledgement being committed: the claim runs out and the reminder is sent again.
+    """
+
+    def __init__(self, notes_database: database.AsyncNotesDatabase, users_database: database.AsyncUsersDatabase, worker_id: str, owns: Callable[[models.UserId], bool] | None = None):
+        self.notes_database = notes_database
+        self.users_database = users_database
+        self.worker_id = worker_id
+        self.owns = owns
+        self.wakeup = asyncio.Event()
+        self.attempts: dict[tuple[int, int], int] = {}
+        # Acknowledgements that arrive while a batch is being committed go into the next one
+        self.acks: list[tuple[int, int, models.ReminderState]] = []
+        self.ack_waiters: list[asyncio.Future] = []
+        self.ack_task: asyncio.Task | None = None
+        # Reminders claimed by an earlier run are released once, before the first claim
+        self.released = False
+        self.purged_at = 0.0
+
+    async def enqueue(self, notes: list[models.UserNote]):
+        await self.notes_database.enqueue_reminders((note.id, note.reminded_times, note.user_id) for note in notes)
+        self.wakeup.set()
+
+    async def drain(self, notification_dispatcher: notifications.NotificationDispatcher):
+        while True:
+            try:
+                await self.drain_once(notification_dispatcher)
+            except Exception as e:
+                logger.exception(f"Failed to deliver reminders from the outbox, retrying in {ERROR_BACKOFF} s: {e}")
+                await asyncio.sleep(ERROR_BACKOFF)
+
+    async def drain_once(self, notification_dispatcher: notifications.NotificationDispatcher):
+        self.wakeup.clear()
+        notification_dispatcher.slot_freed.clear()
+
+        if not self.released:
+            released = await self.notes_database.release_reminders(self.worker_id)
+            if released > 0:
+                logger.info(f"Released {released} reminders claimed before the restart")
+            self.released = True
+
+        if time.time() - self.purged_at >= PURGE_INTERVAL:
+            purged = await self.notes_database.purge_reminders(time.time() - OUTBOX_RETENTION.total_seconds())
+            if purged > 0:
+                logger.info(f"Purged {purged} finished reminders from the outbox")
+            self.purged_at = time.time()
+
+        # Claims of reminders waiting in the dispatcher keep running, only claim what it can take soon.
+        # Notes that are already being sent are left alone, their next reminder is claimed once they are done.
+        limit = OUTBOX_BATCH - len(notification_dispatcher.pending)
+        full = limit < OUTBOX_REFILL
+        claimed = await self.notes_database.claim_reminders(self.worker_id, CLAIM_TTL, limit, self.owns, notification_dispatcher.pending) if not full else []
+        if len(claimed) > 0:
+            await self.submit(claimed, notification_dispatcher)
+
+        if full or len(claimed) < limit:
+            # A full dispatcher is waited on until sends finish, otherwise new reminders wake the loop up
+            event = notification_dispatcher.slot_freed if full else self.wakeup
+            try:
+                await asyncio.wait_for(event.wait(), timeout=OUTBOX_POLL_INTERVAL)
+            except TimeoutError:
+                pass
+
+    async def submit(self, claimed: list[models.QueuedReminder], notification_dispatcher: notifications.NotificationDispatcher):
+        notes = {note.id: note for note in await self.notes_database.get_notes_by_ids([reminder.note_id for reminder in claimed])}
+        dropped: list[tuple[int, int, models.ReminderState]] = []
+        busy: list[tuple[int, int, float]] = []
+
+        for reminder in claimed:
+            note = notes.get(reminder.note_id)
+            # The note was deleted, completed or has moved on since the reminder was queued
+            if note is None or note.is_completed or note.reminded_times != reminder.reminder_index:
+                dropped.append((reminder.note_id, reminder.reminder_index, models.ReminderState.DROPPED))
+                continue
+
+            user = await self.users_database.get_user_by_id(note.user_id)
+            if user is None:
+                dropped.append((reminder.note_id, reminder.reminder_index, models.ReminderState.DROPPED))
+                continue
+
+            if not notification_dispatcher.submit(note, user):
+                # The note is still being sent, it is claimed again after that instead of waiting for the claim to run out
+                busy.append((reminder.note_id, reminder.reminder_index, time.time()))
+                continue
+            self.attempts[(note.id, reminder.reminder_index)] = reminder.attempts
+
+        if len(busy) > 0:
+            await self.notes_database.retry_reminders(busy)
+        if len(dropped) > 0:
+            logger.info(f"Dropped {len(dropped)} reminders of changed notes")
+            await self.notes_database.finish_reminders(dropped)
+
+    async def acknowledge(self, note: models.UserNote, state: models.ReminderState):
+        """Waits until the outcome of the note's current reminder is committed."""
+        self.attempts.pop((note.id, note.reminded_times), None)
+        future = asyncio.get_running_loop().create_future()
+        self.acks.append((note.id, note.reminded_times, state))
+        self.ack_waiters.append(future)
+        if self.ack_task is None:
+            self.ack_task = asyncio.create_task(self.commit_acks())
+        await future
+
+    async def commit_acks(self):
+        while len(self.acks) > 0:
+            acks, waiters = self.acks, self.ack_waiters
+            self.acks, self.ack_waiters = [], []
+            try:
+                await self.notes_database.finish_reminders(acks)
+            except Exception as e:
+                for waiter in waiters:
+                    waiter.set_exception(e)
+            else:
+                for waiter in waiters:
+                    waiter.set_result(None)
+        self.ack_task = None
+
+    async def retry(self, note: models.UserNote) -> bool:
+        """Schedules another attempt of the note's current reminder with exponential backoff, or gives it up."""
+        attempts = self.attempts.pop((note.id, note.reminded_times), MAX_ATTEMPTS)
+        if attempts >= MAX_ATTEMPTS:
+            await self.acknowledge(note, models.ReminderState.FAILED)
+            return False
+
+        delay = min(RETRY_MAX, RETRY_BASE * 2 ** (attempts - 1))
+        await self.notes_database.retry_reminders([(note.id, note.reminded_times, time.time() + delay)])
+        return True
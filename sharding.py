@@ -0,0 +1,339 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable
+
+from aiogram import Bot, Dispatcher
+
+import database
+import models
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 5.0
+LEASE_TTL = 20.0
+# A worker stops using its leases this long before they expire for everyone else
+LEASE_MARGIN = 5.0
+# Released partitions can be claimed only after this, updates being handled by the old owner are finished by then
+RELEASE_GRACE = 20.0
+WORKER_TIMEOUT = 20.0
+POLL_TIMEOUT = 10
+QUEUE_POLL_INTERVAL = 0.05
+QUEUE_BATCH = 100
+
+def partition_of(user_id: models.UserId, partitions: int) -> int:
+    return zlib.crc32(user_id.to_bytes(8, 'little', signed=True)) % partitions
+
+def update_user_id(update: dict[str, Any]) -> models.UserId:
+    """Finds who an update comes from, updates of one user always land in the same partition."""
+    for event in update.values():
+        if isinstance(event, dict):
+            sender = event.get('from') or event.get('user') or event.get('chat')
+            if sender is not None:
+                return sender['id']
+    return 0
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+class ShardDatabase:
+    """Live workers, their leases on partitions of users and the queue of updates the workers share."""
+
+    MIGRATIONS = [
+        """CREATE TABLE IF NOT EXISTS Workers (
+            worker_id TEXT NOT NULL PRIMARY KEY,
+            heartbeat_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS Leases (
+            partition INTEGER NOT NULL PRIMARY KEY,
+            worker_id TEXT,
+            expires_at REAL NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS Intake (
+            id INTEGER NOT NULL PRIMARY KEY CHECK (id = 0),
+            worker_id TEXT,
+            expires_at REAL NOT NULL DEFAULT 0,
+            next_update_id INTEGER NOT NULL DEFAULT 0
+        );
+        INSERT OR IGNORE INTO Intake (id) VALUES (0);
+        CREATE TABLE IF NOT EXISTS Updates (
+            update_id INTEGER NOT NULL PRIMARY KEY,
+            partition INTEGER NOT NULL,
+            payload TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS UpdatesByPartition ON Updates (partition, update_id);""",
+    ]
+
+    def __init__(self, path: str, partitions: int):
+        self.partitions = partitions
+        self.lock = threading.Lock()
+        # Transactions are started explicitly, every one of them takes the write lock right away
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        database.configure_connection(self.db)
+        database.migrate(self.db, "shards", ShardDatabase.MIGRATIONS)
+        self.cur = self.db.cursor()
+        with self.lock, self.transaction():
+            self.cur.executemany("INSERT OR IGNORE INTO Leases (partition) VALUES (?)", ((partition,) for partition in range(partitions)))
+
+    @contextmanager
+    def transaction(self):
+        self.cur.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.cur.execute("ROLLBACK")
+            raise
+        self.cur.execute("COMMIT")
+
+    def rebalance(self, worker_id: str) -> tuple[list[int], list[int]]:
+        """Renews the leases of the worker and moves it towards its share of partitions.
+
+        Returns the partitions the worker holds and the ones among them it has just claimed.
+        """
+        now = time.time()
+        with self.lock, self.transaction():
+            self.cur.execute("INSERT INTO Workers (worker_id, heartbeat_at) VALUES (?, ?) "
+                             "ON CONFLICT (worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at", (worker_id, now))
+            self.cur.execute("DELETE FROM Workers WHERE heartbeat_at < ?", (now - WORKER_TIMEOUT,))
+            self.cur.execute("SELECT worker_id FROM Workers ORDER BY worker_id")
+            workers = [row[0] for row in self.cur.fetchall()]
+            index = workers.index(worker_id)
+            share = self.partitions // len(workers) + (index < self.partitions % len(workers))
+
+            self.cur.execute("UPDATE Leases SET expires_at = ? WHERE worker_id = ? AND expires_at >= ? AND partition < ?",
+                             (now + LEASE_TTL, worker_id, now, self.partitions))
+            self.cur.execute("SELECT partition FROM Leases WHERE worker_id = ? AND expires_at >= ? AND partition < ? ORDER BY partition",
+                             (worker_id, now, self.partitions))
+            owned = [row[0] for row in self.cur.fetchall()]
+
+            claimed = []
+            if len(owned) > share:
+                released = owned[share:]
+                owned = owned[:share]
+                self.cur.executemany("UPDATE Leases SET worker_id = NULL, expires_at = ? WHERE partition = ?",
+                                     ((now + RELEASE_GRACE, partition) for partition in released))
+            elif len(owned) < share:
+                self.cur.execute("SELECT partition FROM Leases WHERE expires_at < ? AND partition < ? ORDER BY partition LIMIT ?",
+                                 (now, self.partitions, share - len(owned)))
+                claimed = [row[0] for row in self.cur.fetchall()]
+                self.cur.executemany("UPDATE Leases SET worker_id = ?, expires_at = ? WHERE partition = ?",
+                                     ((worker_id, now + LEASE_TTL, partition) for partition in claimed))
+                owned = sorted(owned + claimed)
+
+        return owned, claimed
+
+    def leave(self, worker_id: str):
+        now = time.time()
+        with self.lock, self.transaction():
+            self.cur.execute("UPDATE Leases SET worker_id = NULL, expires_at = ? WHERE worker_id = ?", (now + RELEASE_GRACE, worker_id))
+            self.cur.execute("UPDATE Intake SET worker_id = NULL, expires_at = 0 WHERE worker_id = ?", (worker_id,))
+            self.cur.execute("DELETE FROM Workers WHERE worker_id = ?", (worker_id,))
+
+    def acquire_intake(self, worker_id: str) -> int | None:
+        """Takes or renews the right to poll Telegram for updates, returns the update id to poll from."""
+        now = time.time()
+        with self.lock, self.transaction():
+            self.cur.execute("UPDATE Intake SET worker_id = ?, expires_at = ? WHERE id = 0 AND (worker_id = ? OR expires_at < ?)",
+                             (worker_id, now + LEASE_TTL, worker_id, now))
+            if self.cur.rowcount == 0:
+                return None
+            self.cur.execute("SELECT next_update_id FROM Intake WHERE id = 0")
+            return self.cur.fetchone()[0]
+
+    def enqueue(self, updates: list[tuple[int, int, str]], next_update_id: int | None = None):
+        # Update ids are unique, an update Telegram delivers twice is queued once
+        with self.lock, self.transaction():
+            self.cur.executemany("INSERT OR IGNORE INTO Updates (update_id, partition, payload) VALUES (?, ?, ?)", updates)
+            if next_update_id is not None:
+                self.cur.execute("UPDATE Intake SET next_update_id = ? WHERE id = 0", (next_update_id,))
+
+    def fetch(self, partitions: list[int], limit: int) -> list[tuple[int, int, str]]:
+        with self.lock:
+            self.cur.execute(f"SELECT update_id, partition, payload FROM Updates WHERE partition IN ({', '.join('?' * len(partitions))}) "
+                             f"ORDER BY update_id LIMIT ?", (*partitions, limit))
+            return self.cur.fetchall()
+
+    def ack(self, update_ids: list[int]):
+        with self.lock, self.transaction():
+            self.cur.executemany("DELETE FROM Updates WHERE update_id = ?", ((update_id,) for update_id in update_ids))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+class Coordinator:
+    """Lets several bot processes share the users: each user belongs to one of `partitions`, each partition is leased to one worker.
+
+    The owner of a partition alone handles the updates of its users and sends them reminders.
+    Workers that join or leave shift the leases, a released partition is claimable only after a grace period.
+    """
+
+    def __init__(
+        self,
+        shard_database: ShardDatabase,
+        worker_id: str,
+        on_acquired: Callable[[Callable[[models.UserId], bool]], Awaitable[None]],
+        on_released: Callable[[Callable[[models.UserId], bool]], Awaitable[None]]
+    ):
+        self.database = shard_database
+        self.worker_id = worker_id
+        self.on_acquired = on_acquired
+        self.on_released = on_released
+        self.thread = database.DatabaseThread("shards-db")
+        self.partitions: set[int] = set()
+        self.lease_deadline = 0.0
+        self.tasks: list[asyncio.Task] = []
+        self.consume_task: asyncio.Task | None = None
+        # Partition -> the task handling its current batch of updates
+        self.busy: dict[int, asyncio.Task] = {}
+        self.stopping = False
+
+    def partition_of(self, user_id: models.UserId) -> int:
+        return partition_of(user_id, self.database.partitions)
+
+    def in_partitions(self, partitions: set[int]) -> Callable[[models.UserId], bool]:
+        return lambda user_id: self.partition_of(user_id) in partitions
+
+    def owns(self, partition: int) -> bool:
+        return partition in self.partitions and time.monotonic() < self.lease_deadline
+
+    def owns_user(self, user_id: models.UserId) -> bool:
+        return self.owns(self.partition_of(user_id))
+
+    def start(self, dp: Dispatcher, bot: Bot, poll: bool):
+        self.tasks.append(asyncio.create_task(self.maintain()))
+        self.consume_task = asyncio.create_task(self.consume(dp, bot))
+        if poll:
+            self.tasks.append(asyncio.create_task(self.poll(bot, dp.resolve_used_update_types())))
+
+    async def maintain(self):
+        while True:
+            started = time.monotonic()
+            try:
+                owned, claimed = await self.thread.run(self.database.rebalance, self.worker_id)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to renew partition leases: {e}")
+            else:
+                self.lease_deadline = started + LEASE_TTL - LEASE_MARGIN
+                await self.apply(set(owned), set(claimed))
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    async def apply(self, owned: set[int], claimed: set[int]):
+        released = self.partitions - owned
+        # Released partitions stop being served right away
+        self.partitions = owned
+        if len(released) > 0:
+            logger.info(f"Released {len(released)} partitions, holding {len(owned)}")
+            await self.on_released(self.in_partitions(released))
+        # A lease that lapsed and was claimed again may have been held by another worker meanwhile
+        if len(claimed) > 0:
+            logger.info(f"Acquired {len(claimed)} partitions, holding {len(owned)}")
+            await self.on_acquired(self.in_partitions(claimed))
+
+    async def enqueue(self, updates: list[dict[str, Any]], next_update_id: int | None = None):
+        rows = [(update['update_id'], self.partition_of(update_user_id(update)), json.dumps(update, ensure_ascii=False, separators=(',', ':')))
+                for update in updates]
+        await self.thread.run(self.database.enqueue, rows, next_update_id)
+
+    async def poll(self, bot: Bot, allowed_updates: list[str]):
+        """Polls Telegram while this worker holds the intake lease and queues the updates for their owners."""
+        while True:
+            try:
+                offset = await self.thread.run(self.database.acquire_intake, self.worker_id)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to renew the intake lease: {e}")
+                offset = None
+            if offset is None:
+                await asyncio.sleep(HEARTBEAT_INTERVAL)
+                continue
+
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=allowed_updates)
+            except Exception as e:
+                logger.error(f"Failed to get updates: {e}")
+                await asyncio.sleep(HEARTBEAT_INTERVAL)
+                continue
+
+            if len(updates) > 0:
+                # The offset is saved together with the updates, the next intake continues right after them.
+                # If that fails the offset stays where it was and Telegram delivers the same updates again.
+                try:
+                    await self.enqueue([update.model_dump(mode='json', by_alias=True, exclude_unset=True) for update in updates], updates[-1].update_id + 1)
+                except sqlite3.Error as e:
+                    logger.error(f"Failed to queue {len(updates)} updates: {e}")
+                    await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    async def consume(self, dp: Dispatcher, bot: Bot):
+        while not self.stopping:
+            # Partitions still handling their last batch are left out, a slow handler holds up only its own partition
+            partitions = [partition for partition in self.partitions if self.owns(partition) and partition not in self.busy]
+            try:
+                rows = await self.thread.run(self.database.fetch, partitions, QUEUE_BATCH) if len(partitions) > 0 else []
+            except sqlite3.Error as e:
+                logger.error(f"Failed to fetch queued updates: {e}")
+                rows = []
+
+            # Updates of a partition are handled in order, partitions are handled concurrently
+            batches: dict[int, list[tuple[int, str]]] = {}
+            for update_id, partition, payload in rows:
+                batches.setdefault(partition, []).append((update_id, payload))
+            for partition, batch in batches.items():
+                task = self.busy[partition] = asyncio.create_task(self.feed(dp, bot, batch))
+                task.add_done_callback(lambda _, partition=partition: self.busy.pop(partition, None))
+
+            if len(rows) < QUEUE_BATCH:
+                await asyncio.sleep(QUEUE_POLL_INTERVAL)
+
+        await asyncio.gather(*self.busy.values())
+
+    async def feed(self, dp: Dispatcher, bot: Bot, batch: list[tuple[int, str]]):
+        for _, payload in batch:
+            try:
+                await dp.feed_raw_update(bot, json.loads(payload))
+            except Exception as e:
+                logger.exception(f"Failed to handle update: {e}")
+
+        try:
+            await self.thread.run(self.database.ack, [update_id for update_id, _ in batch])
+        except sqlite3.Error as e:
+            logger.error(f"Failed to remove handled updates from the queue: {e}")
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+        # Finishes the updates being handled, then hands the partitions over
+        self.stopping = True
+        if self.consume_task is not None:
+            await self.consume_task
+        self.partitions = set()
+        await self.thread.run(self.database.leave, self.worker_id)
+        await self.thread.run(self.database.close)
+        self.thread.close()
+
+async def run_worker(dp: Dispatcher, bot: Bot):
+    """Runs the dispatcher's startup handlers and keeps the worker alive until it is asked to stop."""
+    workflow_data = {'dispatcher': dp, **dp.workflow_data}
+    await dp.emit_startup(bot=bot, **workflow_data)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await stop.wait()
+
+    logger.info("Shutting down...")
+    try:
+        await dp.emit_shutdown(bot=bot, **workflow_data)
+    finally:
+        await bot.session.close()
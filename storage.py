@@ -0,0 +1,108 @@
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+import database
+
+@dataclass
+class SessionStats:
+    sessions: int = 0
+    total_bytes: int = 0
+    max_bytes: int = 0
+
+    @property
+    def avg_bytes(self) -> float:
+        return self.total_bytes / self.sessions if self.sessions > 0 else 0.0
+
+class SQLiteStorage(BaseStorage):
+    """FSM and dialog storage kept in SQLite so that conversations survive restarts.
+
+    States and data are stored as JSON, sessions that were not written to for `ttl` are treated as abandoned.
+    """
+
+    DATABASE_NAME = "Sessions"
+    MIGRATIONS = [
+        f"""CREATE TABLE IF NOT EXISTS {DATABASE_NAME} (
+            key TEXT NOT NULL PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{{}}',
+            updated_at INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS SessionsByUpdatedAt ON {DATABASE_NAME} (updated_at);""",
+    ]
+
+    def __init__(self, path: str, ttl: timedelta, key_builder: KeyBuilder | None = None):
+        # aiogram_dialog keeps its stacks and contexts under separate destinies
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        database.configure_connection(self.db)
+        database.migrate(self.db, "sessions", SQLiteStorage.MIGRATIONS)
+        self.cur = self.db.cursor()
+        self.thread = database.DatabaseThread("sessions-db")
+
+    def expired_before(self) -> int:
+        return int(time.time() - self.ttl.total_seconds())
+
+    def write(self, key: str, column: str, value: str | None):
+        # The other half of an abandoned session must not come back to life
+        other, empty = ('data', "'{}'") if column == 'state' else ('state', 'NULL')
+        with self.lock, self.db:
+            self.cur.execute(f"INSERT INTO {SQLiteStorage.DATABASE_NAME} (key, {column}, updated_at) VALUES (?, ?, ?) "
+                             f"ON CONFLICT (key) DO UPDATE SET {column} = excluded.{column}, "
+                             f"{other} = CASE WHEN updated_at < ? THEN {empty} ELSE {other} END, updated_at = excluded.updated_at",
+                             (key, value, int(time.time()), self.expired_before()))
+            # A finished conversation leaves nothing behind
+            self.cur.execute(f"DELETE FROM {SQLiteStorage.DATABASE_NAME} WHERE key = ? AND state IS NULL AND data = '{{}}'", (key,))
+
+    def read(self, key: str) -> tuple[str | None, str] | None:
+        with self.lock:
+            self.cur.execute(f"SELECT state, data FROM {SQLiteStorage.DATABASE_NAME} WHERE key = ? AND updated_at >= ?", (key, self.expired_before()))
+            return self.cur.fetchone()
+
+    def delete_expired(self) -> int:
+        with self.lock, self.db:
+            self.cur.execute(f"DELETE FROM {SQLiteStorage.DATABASE_NAME} WHERE updated_at < ?", (self.expired_before(),))
+            return self.cur.rowcount
+
+    def session_stats(self) -> SessionStats:
+        with self.lock:
+            # LENGTH counts characters of a TEXT value, the cast makes it count the encoded bytes
+            size = "LENGTH(CAST(data AS BLOB)) + IFNULL(LENGTH(CAST(state AS BLOB)), 0)"
+            self.cur.execute(f"SELECT COUNT(*), TOTAL({size}), MAX({size}) "
+                             f"FROM {SQLiteStorage.DATABASE_NAME} WHERE updated_at >= ?", (self.expired_before(),))
+            row = self.cur.fetchone()
+        return SessionStats(sessions=row[0], total_bytes=int(row[1]), max_bytes=row[2] or 0)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self.thread.run(self.write, self.key_builder.build(key), 'state', value)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        row = await self.thread.run(self.read, self.key_builder.build(key))
+        return row[0] if row is not None else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        value = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        await self.thread.run(self.write, self.key_builder.build(key), 'data', value)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        row = await self.thread.run(self.read, self.key_builder.build(key))
+        return json.loads(row[1]) if row is not None else {}
+
+    async def purge(self) -> tuple[int, SessionStats]:
+        """Deletes abandoned sessions and measures the remaining ones."""
+        deleted = await self.thread.run(self.delete_expired)
+        return deleted, await self.thread.run(self.session_stats)
+
+    async def close(self) -> None:
+        await self.thread.run(self.db.close)
+        self.thread.close()
@@ -2,7 +2,6 @@ from typing import Iterable
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from datetime import datetime, time, timedelta, date
 from zoneinfo import ZoneInfo
-from contextlib import contextmanager
 
 from aiogram_dialog import DialogManager
 from aiogram_dialog.widgets.kbd.calendar_kbd import Calendar, CalendarConfig, CalendarUserConfig, CalendarScope, CalendarScopeView, CalendarDaysView, CalendarMonthView, CalendarYearsView
@@ -10,8 +9,6 @@ from aiogram_dialog.widgets.text import Format, Text
 
 from babel.dates import get_day_names, get_month_names
 
-import threading
-import locale
 import models
 from callbacks import NumCallback
 
@@ -121,18 +118,6 @@ def user_reminder_times_to_text(user: models.User) -> str:
         
     return reminder_times_text
 
-LOCALE_LOCK = threading.Lock()
-
-@contextmanager
-def time_locale(name: str):
-    with LOCALE_LOCK:
-        saved = locale.setlocale(locale.LC_TIME)
-        try:
-            yield locale.setlocale(locale.LC_TIME, name)
-        finally:
-            locale.setlocale(locale.LC_TIME, saved)
-            
-            
 async def schedule_reminder(until: datetime):
     pass
 
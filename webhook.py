@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import signal
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+import sharding
+
+logger = logging.getLogger(__name__)
+
+HEALTH_PATH = '/health'
+
+class WebhookRequestHandler(SimpleRequestHandler):
+    """Answers Telegram right away and handles updates in the background, finishing them before shutting down.
+
+    With a coordinator the updates are put in the queue shared by the workers instead, for the owners of their users.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str, coordinator: sharding.Coordinator | None = None):
+        super().__init__(dispatcher=dispatcher, bot=bot, secret_token=secret_token)
+        self.coordinator = coordinator
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        if self.coordinator is None:
+            return await super()._handle_request_background(bot, request)
+
+        # Telegram delivers the update again unless it is queued
+        await self.coordinator.enqueue([await request.json(loads=bot.session.json_loads)])
+        return web.json_response({})
+
+    async def close(self):
+        pending = tuple(self._background_feed_update_tasks)
+        if len(pending) > 0:
+            logger.info(f"Waiting for {len(pending)} updates to be handled...")
+            await asyncio.gather(*pending, return_exceptions=True)
+        await super().close()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({'status': 'ok', 'pending_updates': len(self._background_feed_update_tasks)})
+
+async def run_webhook(dp: Dispatcher, bot: Bot, url: str, path: str, secret: str, host: str, port: int, coordinator: sharding.Coordinator | None = None):
+    app = web.Application()
+
+    handler = WebhookRequestHandler(dispatcher=dp, bot=bot, secret_token=secret, coordinator=coordinator)
+    handler.register(app, path=path)
+    app.router.add_get(HEALTH_PATH, handler.handle_health)
+    # Runs the dispatcher's startup and shutdown handlers together with the application
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=port)
+    await site.start()
+
+    await bot.set_webhook(url + path, secret_token=secret, allowed_updates=dp.resolve_used_update_types())
+    logger.info(f"Listening for updates on {host}:{port}{path}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await stop.wait()
+
+    # Stops accepting requests, then lets the handlers finish and runs the shutdown handlers
+    logger.info("Shutting down...")
+    await runner.cleanup()